@@ -14,34 +14,95 @@
 # ------------------------------------------------------------------------------
 
 import hashlib
+import os
 import base64
 import time
-import requests
-import yaml
 import json
 import cbor
 import logging #debug
 
-from sawtooth_signing import create_context
-from sawtooth_signing import CryptoFactory
-from sawtooth_signing import ParseError
-from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
-from sawtooth_signing.secp256k1 import Secp256k1PublicKey
+from concurrent.futures import ThreadPoolExecutor
+
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 
-from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
 from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
 from sawtooth_sdk.protobuf.batch_pb2 import BatchList
-from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
 from sawtooth_sdk.protobuf.batch_pb2 import Batch
 
+from cli.capbac_builder import TransactionBuilder
+from cli.capbac_cache import DEFAULT_CACHE_SIZE
+from cli.capbac_cache import DEFAULT_MAX_STALENESS
+from cli.capbac_cache import CachedState
+from cli.capbac_cache import DeviceStateCache
 from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_rate import RateController
+from cli.capbac_rules import BUDGET_ADDRESSES
+from cli.capbac_rules import DelegationError
+from cli.capbac_rules import DeviceState
+from cli.capbac_rules import check_issue
+from cli.capbac_rules import format_rights
+from cli.capbac_rules import parse_budget_setting
+from cli.capbac_signer import load_signer
+from cli.capbac_signer import verify
+from cli.capbac_submitter import BatchSubmitter
+from cli.capbac_transport import DEFAULT_PAGE_SIZE
+from cli.capbac_transport import DEFAULT_POOL_SIZE
+from cli.capbac_transport import DEFAULT_RETRIES
+from cli.capbac_transport import DEFAULT_TIMEOUT
+from cli.capbac_transport import create_transport
 from cli.capbac_version import *
 
 LOGGER = logging.getLogger(__name__)
 
+WAIT_SLICE = 5 # seconds of each long-poll of the batch statuses
+
+# kept well below the validator limits on batch and message size
+MAX_BATCH_TRANSACTIONS = 100
+MAX_BATCH_BYTES = 1024 * 1024
+
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
 
+# no device address ends with 64 zeros: probed for the head alone
+_HEAD_PROBE_ADDRESS = _sha512(FAMILY_NAME.encode('utf-8'))[0:6] + '0' * 64
+
+def _decode_entries(entries):
+    return {
+        identifier: token
+        for entry in entries
+        for identifier, token in cbor.loads(base64.b64decode(entry["data"])).items()
+    }
+
+def get_batch_ids(response):
+    """Batch ids of the statuses link returned by a submission."""
+    link = json.loads(response)['link']
+    return parse_qs(urlparse(link).query)['id'][0].split(',')
+
+def _signed_message(token):
+    # what SI signs: the token without SI, as the processor serializes it
+    return str(cbor.dumps(token,sort_keys=True)).encode('utf-8')
+
+def _verify_all(checks):
+    return [verify(signature, message, public_key)
+            for _, signature, message, public_key in checks]
+
+def _split_batches(transactions, size_of):
+    # within MAX_BATCH_TRANSACTIONS and MAX_BATCH_BYTES, in order
+    pending = []
+    size = 0
+    for transaction in transactions:
+        transaction_size = size_of(transaction)
+        if pending and (len(pending) >= MAX_BATCH_TRANSACTIONS
+                        or size + transaction_size > MAX_BATCH_BYTES):
+            yield pending
+            pending = []
+            size = 0
+        pending.append(transaction)
+        size += transaction_size
+    if pending:
+        yield pending
+
 def _check_format(dictionary,name,dictionary_format,subset=None):
     if subset is None:
         subset = set(dictionary_format)
@@ -77,44 +138,66 @@ def _check_format(dictionary,name,dictionary_format,subset=None):
         if label not in subset:
             raise CapBACClientException("Invalid {}: unexpected label {}".format(name,label))
 
-class CapBACClient:
-    def __init__(self, url, keyfile=None):
-        self.url = url
+class _Precheck:
+    """Delegation rules of the processor run on the state read by the client.
 
-        if keyfile is not None:
-            try:
-                with open(keyfile) as fd:
-                    private_key_str = fd.read().strip()
-                    fd.close()
-            except OSError as err:
-                raise CapBACClientException(
-                    'Failed to read private key: {}'.format(str(err)))
+    Tokens passing the check are added to a local copy of their device
+    state, so later tokens of the same submission can delegate from them;
+    the copy is made once per device and grows in place, keeping the chain
+    indexes and the entry size. Tokens sent by earlier, still uncommitted,
+    submissions are not seen.
+    """
 
-            try:
-                private_key = Secp256k1PrivateKey.from_hex(private_key_str)
-            except ParseError as e:
-                raise CapBACClientException(
-                    'Unable to load private key: {}'.format(str(e)))
+    def __init__(self, client, budget):
+        self._client = client
+        self._budget = budget
+        self._entries = {}
 
-            self._signer = CryptoFactory(
-                create_context('secp256k1')).new_signer(private_key)
+    def check(self, token, subject):
+        device = token['DE']
+        entry = self._entries.get(device)
+        if entry is None:
+            fetched = self._client._get_cached_state(device)
+            # (the cached tokens are shared, and must not grow)
+            entry = DeviceState(None, dict(fetched.state), fetched.size)
+            self._entries[device] = entry
+
+        # stored form, as the processor will save it
+        identifier = token['ID']
+        stored = {label: value for label, value in token.items()
+                  if label not in ('ID', 'VR')}
+        stored['AR'] = format_rights(token['AR'])
 
-    # For each valid cli commands in _cli.py file
-    # Add methods to:
-    # 1. Do any additional handling, if required
-    # 2. Create a transaction and a batch
-    # 2. Send to rest-api
+        try:
+            check_issue(identifier, stored, token['IC'], subject, entry,
+                        self._budget, int(time.time()))
+        except DelegationError as err:
+            raise CapBACClientException(str(err))
 
-    def issue(self, token, is_root):
+        entry.add(identifier, stored)
 
-        try:
-            token = json.loads(token)
-        except:
-            raise CapBACClientException('Invalid token: serialization failed')
+class CapBACLocalClient:
+    """Token checks, signing and transaction building, without any I/O.
 
-        return self.issue_from_dict(token, is_root)
+    Shared by CapBACClient and AsyncCapBACClient, which only add the
+    requests to the ledger.
+    """
 
-    def issue_from_dict(self,token, is_root):
+    def __init__(self, keyfile=None):
+        if keyfile is not None:
+            # shared by every client of the process using the same key
+            self._signer = load_signer(keyfile)
+            self._builder = TransactionBuilder(self._signer)
+
+    def _create_issue_transaction(self, token, is_root, dependencies=(), batcher=None,
+                                  precheck=None):
+
+        payload = self.issue_payload(token, is_root, precheck)
+
+        return self._create_transaction(
+            payload, 'issue', token['DE'], dependencies, batcher)
+
+    def issue_payload(self, token, is_root, precheck=None):
 
         # check the formal validity of the incomplete token
         subset = set(CAPABILITY_FORMAT) - {'II','SI','VR'}
@@ -141,30 +224,28 @@ class CapBACClient:
 
         if is_root:
             token['IC'] = None
-            token['SU'] = self._signer.get_public_key().as_hex()
+            token['SU'] = self._signer.public_key_hex
 
         # add signature
         token= self.sign_dict(token)
 
         # now the token is complete
 
-        payload = cbor.dumps({
+        if precheck is not None:
+            precheck.check(token, self._signer.public_key_hex)
+
+        return cbor.dumps({
             'AC': "issue",
             'OB': token
         })
 
-        return self._send_transaction(payload, token['DE'])
+    def _create_revoke_transaction(self, token):
 
-    def revoke(self, token):
+        payload = self.revoke_payload(token)
 
-        try:
-            token = json.loads(token)
-        except:
-            raise CapBACClientException('Invalid revocation token: serialization failed')
+        return self._create_transaction(payload, 'revoke', token['DE'])
 
-        return self.revoke_from_dict(token)
-
-    def revoke_from_dict(self, token):
+    def revoke_payload(self, token):
 
         # check the formal validity of the incomplete revocation token
         subset = set(REVOCATION_FORMAT) - {'II','SI','VR'}
@@ -176,70 +257,29 @@ class CapBACClient:
 
         # now the revocation token is complete
 
-        payload = cbor.dumps({
+        return cbor.dumps({
             'AC': "revoke",
             'OB': token
         })
 
-        return self._send_transaction(payload, token['DE'])
-
-    def list(self,device):
-
-        if len(device) > MAX_URI_LENGTH:
-            raise CapBACClientException(
-                'Invalid URI: max length exceeded, should be less than {}'
-                .format(MAX_URI_LENGTH))
-
-        result = self._send_request(
-            "state?address={}".format(
-                self._get_address(device)))
-
-        try:
-            encoded_entries = yaml.safe_load(result)["data"]
-
-            data_list = [
-                cbor.loads(base64.b64decode(entry["data"]))
-                for entry in encoded_entries
-            ]
-
-            return json.dumps({
-                x:y[x] for y in data_list for x in y
-            }, indent=4, sort_keys=True)
+    def _check_access(self, token, state):
 
-        except BaseException:
-            return None
-
-    def validate(self,token):
-
-        try:
-            token = json.loads(token)
-        except:
-            raise CapBACClientException('Invalid access token: serialization failed')
-
-        return self.validate_from_dict(token)
-
-    def validate_from_dict(self,token):
-
-        _check_format(token,"access token",VALIDATION_FORMAT)
-
-        # state retrival
-        device = token['DE']
-        result = self._send_request(
-            "state?address={}".format(
-                self._get_address(device)))
-
-        try:
-            encoded_entries = yaml.safe_load(result)["data"]
+        if not self._check_chain(token, state, int(time.time())):
+            return False
 
-            data_list =  [
-                cbor.loads(base64.b64decode(entry["data"]))
-                for entry in encoded_entries
-            ]
+        LOGGER.info('checking signature')
+        # check signature
+        signature = token.pop('SI')
+        if not verify(
+            signature,
+            _signed_message(token),
+            state[token['IC']]['SU']
+            ):
+            return False
 
-            state = {x:y[x] for y in data_list for x in y}
+        return True
 
-        except BaseException:
-            return None
+    def _check_chain(self, token, state, now):
 
         LOGGER.info('checking authorization')
         # check authorization
@@ -250,7 +290,6 @@ class CapBACClient:
 
         LOGGER.info('checking delegation chain')
         # delegation chain check
-        now = int(time.time())
         resource = token['RE']
         action = token['AC']
 
@@ -277,16 +316,6 @@ class CapBACClient:
             current_token = parent_token
             parent = current_token['IC']
 
-        LOGGER.info('checking signature')
-        # check signature
-        signature = token.pop('SI')
-        if not create_context('secp256k1').verify(
-            signature,
-            str(cbor.dumps(token,sort_keys=True)).encode('utf-8'),
-            Secp256k1PublicKey.from_hex(state[capability]['SU'])
-            ):
-            return False
-
         return True
 
     def sign(self, token):
@@ -309,8 +338,7 @@ class CapBACClient:
         token['II'] = str(now)
 
         # add signature
-        token_serialized = str(cbor.dumps(token,sort_keys=True)).encode('utf-8')
-        token['SI'] = self._signer.sign(token_serialized)
+        token['SI'] = self._signer.sign(_signed_message(token))
 
         return token
 
@@ -322,83 +350,551 @@ class CapBACClient:
         device_address = _sha512(device.encode('utf-8'))[64:]
         return prefix + device_address
 
-    def _send_request(self,
-                      suffix,
-                      data=None,
-                      contentType=None):
-        if self.url.startswith("http://"):
-            url = "{}/{}".format(self.url, suffix)
-        else:
-            url = "http://{}/{}".format(self.url, suffix)
-
-        headers = {}
-
-        if contentType is not None:
-            headers['Content-Type'] = contentType
-
-        try:
-            if data is not None:
-                result = requests.post(url, headers=headers, data=data)
-            else:
-                result = requests.get(url, headers=headers)
-
-            if not result.ok:
-                raise CapBACClientException("Error {}: {}".format(
-                    result.status_code, result.reason))
-
-        except requests.ConnectionError as err:
-            raise CapBACClientException(
-                'Failed to connect to {}: {}'.format(url, str(err)))
+    def _get_inputs_outputs(self, action, device):
+        # declare exactly what the processor reads and writes, so that the
+        # validator's scheduler only serializes transactions that conflict
+        address = self._get_address(device)
 
-        except BaseException as err:
-            raise CapBACClientException(err)
+        inputs = [address]
+        if action == 'issue': # the budget settings are only read
+            inputs += list(BUDGET_ADDRESSES.values())
 
-        return result.text
+        return inputs, [address]
 
-    def _send_transaction(self, payload, device):
+    def _create_transaction(self, payload, action, device, dependencies=(),
+                            batcher=None):
+        # batcher is the public key of the batch signer, if not this client
 
-        # Get the unique address for the device's tokens
-        address = self._get_address(device)
+        # Get the addresses read and written for the device's tokens
+        inputs, outputs = self._get_inputs_outputs(action, device)
 
-        header = TransactionHeader(
-            signer_public_key=self._signer.get_public_key().as_hex(),
-            family_name=FAMILY_NAME,
-            family_version=FAMILY_VERSION,
-            inputs=[address],
-            outputs=[address],
-            dependencies=[],
-            payload_sha512=_sha512(payload),
-            batcher_public_key=self._signer.get_public_key().as_hex(),
-            nonce=time.time().hex().encode()
-        ).SerializeToString()
+        header = self._builder.header(payload, inputs, outputs, dependencies, batcher)
 
         signature = self._signer.sign(header)
 
-        transaction = Transaction(
+        return Transaction(
             header=header,
             payload=payload,
             header_signature=signature
         )
 
-        batch_list = self._create_batch_list([transaction])
+    def build_transaction(self, payload, action, device):
+        """Signed and serialized at once: (signature, Transaction bytes)."""
+        inputs, outputs = self._get_inputs_outputs(action, device)
+        return self._builder.transaction(payload, inputs, outputs)
 
-        return self._send_request(
-            "batches", batch_list.SerializeToString(),
-            'application/octet-stream'
-        )
+    def build_batches(self, transactions):
+        """Serialized Batches of (signature, Transaction bytes) pairs, split
+        like _create_batches.
+        """
+        return [
+            self._builder.batch(pending)[1]
+            for pending in _split_batches(transactions, lambda pair: len(pair[1]))
+        ]
 
     def _create_batch_list(self, transactions):
+        return BatchList(batches=[self._create_batch(transactions)])
+
+    def _create_batches(self, transactions):
+        return [
+            self._create_batch(pending)
+            for pending in _split_batches(transactions, Transaction.ByteSize)
+        ]
+
+    def _create_batch(self, transactions):
         transaction_signatures = [t.header_signature for t in transactions]
 
-        header = BatchHeader(
-            signer_public_key=self._signer.get_public_key().as_hex(),
-            transaction_ids=transaction_signatures
-        ).SerializeToString()
+        header = self._builder.batch_header(transaction_signatures)
 
         signature = self._signer.sign(header)
 
-        batch = Batch(
+        return Batch(
             header=header,
             transactions=transactions,
             header_signature=signature)
-        return BatchList(batches=[batch])
+
+class CapBACClient(CapBACLocalClient):
+    def __init__(self, url, keyfile=None, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 cache_size=DEFAULT_CACHE_SIZE, max_staleness=DEFAULT_MAX_STALENESS,
+                 precheck=False, adaptive=False, target_latency=None):
+        CapBACLocalClient.__init__(self, keyfile)
+        self.url = url
+        self.timeout = timeout
+
+        # run the processor's delegation rules before submitting issues
+        self.precheck = precheck
+        self._precheck_budget = None
+
+        # decoded device states, tagged with the head block (0 to disable)
+        self._cache = None
+        if cache_size > 0:
+            self._cache = DeviceStateCache(cache_size, max_staleness)
+
+        # REST API, or validator component endpoint for tcp:// urls
+        self._transport = create_transport(url, pool_size, timeout, retries)
+
+        # submissions paced by the validator's backpressure (and, with a
+        # target latency in seconds, by the commit latency)
+        self._rate = None
+        if adaptive:
+            self._rate = RateController(self._transport, target_latency=target_latency)
+
+    def close(self):
+        self._transport.close()
+
+    # For each valid cli commands in _cli.py file
+    # Add methods to:
+    # 1. Do any additional handling, if required
+    # 2. Create a transaction and a batch
+    # 2. Send to rest-api
+
+    def issue(self, token, is_root):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid token: serialization failed')
+
+        return self.issue_from_dict(token, is_root)
+
+    def issue_from_dict(self,token, is_root):
+
+        transaction = self._create_issue_transaction(
+            token, is_root, precheck=self._new_precheck())
+        self.invalidate(token['DE'])
+
+        return self._send_transactions([transaction])
+
+    def revoke(self, token):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid revocation token: serialization failed')
+
+        return self.revoke_from_dict(token)
+
+    def revoke_from_dict(self, token):
+
+        transaction = self._create_revoke_transaction(token)
+        self.invalidate(token['DE'])
+
+        return self._send_transactions([transaction])
+
+    def submit(self, operations):
+        """Sends several issues and revocations, across devices, at once.
+
+        Each operation is a dict {'AC': 'issue' or 'revoke', 'OB': token}
+        (plus 'root': True for root tokens). The transactions are split in
+        batches within the validator limits and all the batches are posted
+        in a single BatchList. Returns the batch statuses link and, in input
+        order, either the batch and transaction ids or the error preventing
+        the operation from being sent.
+        """
+        results = []
+        transactions = []
+        devices = set()
+        precheck = self._new_precheck()
+        for operation in operations:
+            try:
+                if operation.get('AC') == 'issue':
+                    transaction = self._create_issue_transaction(
+                        operation['OB'], operation.get('root', False),
+                        precheck=precheck)
+                elif operation.get('AC') == 'revoke':
+                    transaction = self._create_revoke_transaction(operation['OB'])
+                else:
+                    raise CapBACClientException(
+                        'Invalid operation: AC should be issue or revoke')
+            except (CapBACClientException, KeyError, TypeError) as err:
+                results.append({'error': str(err)})
+                continue
+            results.append(transaction)
+            transactions.append(transaction)
+            devices.add(operation['OB']['DE'])
+
+        if not transactions:
+            return {'link': None, 'results': results}
+
+        link, batch_ids = self._send_batches(transactions)
+        for device in devices:
+            self.invalidate(device)
+
+        for index, result in enumerate(results):
+            if isinstance(result, Transaction):
+                results[index] = {
+                    'batch_id': batch_ids[result.header_signature],
+                    'transaction_id': result.header_signature
+                }
+
+        return {'link': link, 'results': results}
+
+    def issue_tree(self, tree):
+        """Issues a whole delegation tree in one submission.
+
+        The tree is a dict {'token': token, 'root': bool, 'children': [...]}
+        whose children are trees too. A node can also name the 'keyfile' of
+        its issuer (the subject of the parent token), otherwise it is signed
+        with this client's key. Every transaction depends on the one issuing
+        its parent token, so the validator can schedule the whole tree at
+        once without waiting for each level to be committed.
+        Returns the batch statuses link and the batch and transaction ids of
+        the tokens in depth-first order (parents first).
+        """
+        batcher = self._signer.public_key_hex
+        issuers = {None: self}
+        precheck = self._new_precheck()
+
+        transactions = []
+        devices = set()
+        pending = [(tree, [])]
+        while pending:
+            node, dependencies = pending.pop()
+            keyfile = node.get('keyfile')
+            if keyfile not in issuers:
+                # only signs (key and TransactionBuilder); sent through self
+                issuers[keyfile] = CapBACLocalClient(keyfile)
+            transaction = issuers[keyfile]._create_issue_transaction(
+                node['token'], node.get('root', False), dependencies, batcher,
+                precheck)
+            transactions.append(transaction)
+            devices.add(node['token']['DE'])
+            for child in reversed(node.get('children', [])):
+                pending.append((child, [transaction.header_signature]))
+
+        link, batch_ids = self._send_batches(transactions)
+        for device in devices:
+            self.invalidate(device)
+
+        return {'link': link, 'results': [{
+            'batch_id': batch_ids[transaction.header_signature],
+            'transaction_id': transaction.header_signature
+        } for transaction in transactions]}
+
+    def _new_precheck(self):
+        if not self.precheck:
+            return None
+        # the settings are read once: the pre-check is only advisory
+        if self._precheck_budget is None:
+            self._precheck_budget = self._get_budget()
+        return _Precheck(self, self._precheck_budget)
+
+    def issue_many(self, tokens, is_root=False):
+        return self.submit([
+            {'AC': 'issue', 'OB': token, 'root': is_root} for token in tokens])
+
+    def revoke_many(self, tokens):
+        return self.submit([{'AC': 'revoke', 'OB': token} for token in tokens])
+
+    def submitter(self, **kwargs):
+        """Starts a BatchSubmitter sending its batches through this client."""
+        return BatchSubmitter(self, **kwargs)
+
+    def wait_for_commit(self, batch_ids, timeout=DEFAULT_WAIT):
+        """Waits for the batches to leave the PENDING status.
+
+        Returns {batch_id: status} where each status is the REST API entry
+        (status and invalid transactions); batches still pending after
+        `timeout` seconds are reported as such.
+        """
+        statuses = {
+            batch_id: {'status': 'PENDING', 'invalid_transactions': []}
+            for batch_id in batch_ids
+        }
+        for batch_id, status in self.iter_batch_statuses(batch_ids, timeout):
+            statuses[batch_id] = status
+        return statuses
+
+    def iter_batch_statuses(self, batch_ids, timeout=DEFAULT_WAIT):
+        """Yields (batch_id, status) as soon as each batch is COMMITTED or
+        INVALID.
+
+        All the batches still pending are long-polled together, using the
+        wait parameter of the batch statuses. A batch unknown to the
+        validator may not have reached it yet, so it is waited for like a
+        pending one; those still unknown when `timeout` expires are
+        yielded last as UNKNOWN.
+        """
+        pending = set(batch_ids)
+        unknown = set()
+        deadline = time.time() + timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            wait = max(1, int(min(remaining, WAIT_SLICE)))
+            for entry in self._transport.get_batch_statuses(sorted(pending), wait):
+                if entry['id'] not in pending:
+                    continue
+                if entry['status'] == 'UNKNOWN':
+                    unknown.add(entry['id'])
+                elif entry['status'] != 'PENDING':
+                    pending.discard(entry['id'])
+                    unknown.discard(entry['id'])
+                    yield entry['id'], {
+                        'status': entry['status'],
+                        'invalid_transactions': entry['invalid_transactions']
+                    }
+                else:
+                    unknown.discard(entry['id'])
+
+        for batch_id in sorted(unknown & pending):
+            yield batch_id, {'status': 'UNKNOWN', 'invalid_transactions': []}
+
+    def list(self,device):
+
+        if len(device) > MAX_URI_LENGTH:
+            raise CapBACClientException(
+                'Invalid URI: max length exceeded, should be less than {}'
+                .format(MAX_URI_LENGTH))
+
+        try:
+            state = self._get_state(device)
+        except CapBACClientException:
+            raise
+        except BaseException:
+            return None
+
+        return json.dumps(state, indent=4, sort_keys=True)
+
+    def stream_list(self, device, output):
+        """Writes the tokens of the device to `output` as one JSON object.
+
+        Tokens are written as they are decoded, one page of state entries
+        at a time, so that memory stays bounded whatever the device size
+        (keys are not sorted).
+        """
+        if len(device) > MAX_URI_LENGTH:
+            raise CapBACClientException(
+                'Invalid URI: max length exceeded, should be less than {}'
+                .format(MAX_URI_LENGTH))
+
+        separator = '{\n'
+        for identifier, token in self.iter_state(device):
+            output.write('{}    {}: {}'.format(
+                separator, json.dumps(identifier), json.dumps(token, sort_keys=True)))
+            separator = ',\n'
+        output.write('{}\n' if separator == '{\n' else '\n}\n')
+
+    def iter_state(self, device, limit=DEFAULT_PAGE_SIZE):
+        """Yields the (identifier, token) pairs stored for the device.
+
+        State pages are followed one at a time; each page is parsed and
+        released before the next one is fetched.
+        """
+        for data in self._iter_entries(self._get_address(device), limit):
+            for identifier, token in cbor.loads(data).items():
+                yield identifier, token
+
+    def _iter_entries(self, address, limit=DEFAULT_PAGE_SIZE):
+        # raw data of the state entries under the address prefix
+        for _, entries in self._transport.iter_pages(address, limit):
+            for data in entries:
+                yield data
+
+    def invalidate(self, device=None):
+        """Drops the cached state of the device (of every device if None)."""
+        if self._cache is not None:
+            self._cache.invalidate(device)
+
+    def _get_state(self, device):
+        return self._get_cached_state(device).state
+
+    def _get_cached_state(self, device):
+        # CachedState of the device: tokens, head and encoded size
+        if self._cache is None:
+            return self._fetch_state(device)
+
+        entry = self._cache.get(device)
+        if entry is not None:
+            if self._cache.is_fresh(entry):
+                return entry
+            if self._get_head() == entry.head:
+                self._cache.refresh(entry)
+                return entry
+
+        return self._fetch_state(device)
+
+    def _fetch_state(self, device):
+        # the following pages are read at the head of the first one
+        state = {}
+        head = None
+        size = 0
+        pages = self._transport.iter_pages(self._get_address(device), DEFAULT_PAGE_SIZE)
+        for page_head, entries in pages:
+            head = head or page_head
+            for data in entries:
+                size += len(data)
+                state.update(cbor.loads(data))
+
+        if self._cache is None:
+            return CachedState(state, head, size)
+        return self._cache.put(device, state, head, size)
+
+    def _get_head(self):
+        # head of a state read of an address no device hashes to: an empty
+        # page, tagged like the pages of _fetch_state (not a whole block)
+        for head, _ in self._transport.iter_pages(_HEAD_PROBE_ADDRESS, 1):
+            return head
+
+    def budget(self,devices):
+
+        limits = self._get_budget()
+
+        reports = {}
+        for device in devices:
+
+            if len(device) > MAX_URI_LENGTH:
+                raise CapBACClientException(
+                    'Invalid URI: max length exceeded, should be less than {}'
+                    .format(MAX_URI_LENGTH))
+
+            try:
+                raw_entries = list(self._iter_entries(self._get_address(device)))
+                state = {x:y[x] for y in map(cbor.loads, raw_entries) for x in y}
+
+            except CapBACClientException:
+                raise
+            except BaseException:
+                reports[device] = None
+                continue
+
+            # longest delegation chain currently stored
+            depth = 0
+            for identifier in state:
+                length = 0
+                parent = state[identifier]['IC']
+                while parent is not None and parent in state:
+                    length += 1
+                    parent = state[parent]['IC']
+                depth = max(depth, length)
+
+            reports[device] = {
+                'tokens': len(state),
+                'bytes': sum(len(raw) for raw in raw_entries),
+                'depth': depth
+            }
+            reports[device].update(limits)
+
+        return json.dumps(reports, indent=4, sort_keys=True)
+
+    def _get_budget(self):
+        # parsed as the processor does: unusable values are no limit
+        budget = {}
+        for name, address in BUDGET_ADDRESSES.items():
+            budget[name] = None
+            for data in self._iter_entries(address):
+                try:
+                    budget[name] = parse_budget_setting(BUDGET_SETTINGS[name], data)
+                except ValueError as err:
+                    raise CapBACClientException(str(err))
+        return budget
+
+    def validate(self,token):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid access token: serialization failed')
+
+        return self.validate_from_dict(token)
+
+    def validate_from_dict(self,token):
+
+        _check_format(token,"access token",VALIDATION_FORMAT)
+
+        # state retrival
+        try:
+            state = self._get_state(token['DE'])
+        except CapBACClientException:
+            raise
+        except BaseException:
+            return None
+
+        return self._check_access(token, state)
+
+    def validate_many(self, tokens, workers=None):
+        """Validates a burst of access tokens, returning decisions in input order.
+
+        Tokens are grouped by device so that each device state is read once,
+        and the delegation chain is walked once per capability, resource and
+        action. Signatures are verified in parallel by `workers` threads (one
+        per core by default). A decision is None when the token is malformed
+        or its device state can't be read.
+        """
+        decisions = [None] * len(tokens)
+
+        devices = {}
+        for index, token in enumerate(tokens):
+            try:
+                _check_format(token,"access token",VALIDATION_FORMAT)
+            except CapBACClientException as err:
+                LOGGER.warning('access token %d: %s', index, err)
+                continue
+            devices.setdefault(token['DE'], []).append(index)
+
+        now = int(time.time())
+        signed = [] # (index, signature, message, public key)
+        for device, indexes in devices.items():
+            # state retrival
+            try:
+                state = self._get_state(device)
+            except CapBACClientException:
+                raise
+            except BaseException:
+                continue
+
+            chains = {}
+            for index in indexes:
+                token = tokens[index]
+                key = (token['IC'], token['RE'], token['AC'])
+                if key not in chains:
+                    try:
+                        chains[key] = self._check_chain(token, state, now)
+                    except BaseException:
+                        chains[key] = None
+                decisions[index] = chains[key]
+                if chains[key]:
+                    unsigned = {
+                        label: value for label, value in token.items() if label != 'SI'}
+                    signed.append((index, token['SI'], _signed_message(unsigned),
+                                   state[token['IC']]['SU']))
+
+        # one slice of the checks per thread, the verification releases the GIL
+        workers = workers or os.cpu_count() or 1
+        size = -(-len(signed) // workers) or 1
+        slices = [signed[start:start + size] for start in range(0, len(signed), size)]
+        if len(slices) > 1:
+            with ThreadPoolExecutor(len(slices)) as executor:
+                results = list(executor.map(_verify_all, slices))
+        else:
+            results = [_verify_all(checks) for checks in slices]
+
+        for checks, verified in zip(slices, results):
+            for (index, _, _, _), result in zip(checks, verified):
+                decisions[index] = result
+
+        return decisions
+
+    def _send_transactions(self, transactions):
+
+        return self._submit([self._create_batch(transactions)])
+
+    def _send_batches(self, transactions):
+        # split within the validator limits, posted in a single BatchList
+        batches = self._create_batches(transactions)
+
+        response = self._submit(batches)
+
+        batch_ids = {
+            transaction.header_signature: batch.header_signature
+            for batch in batches for transaction in batch.transactions
+        }
+
+        return json.loads(response).get('link'), batch_ids
+
+    def _submit(self, batches):
+        if self._rate is None:
+            return self._transport.submit(batches)
+        return self._rate.submit(batches)
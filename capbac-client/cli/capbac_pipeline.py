@@ -0,0 +1,150 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import json
+import logging
+import multiprocessing
+import time
+
+from collections import deque
+from itertools import islice
+
+from cli.capbac_client import CapBACLocalClient
+from cli.capbac_client import MAX_BATCH_TRANSACTIONS
+from cli.capbac_exceptions import CapBACClientException
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100 # operations sent to a worker at once
+REPORT_INTERVAL = 10 # seconds between throughput reports
+
+# signing client of each worker process
+_client = None
+
+def read_operations(fd):
+    """Yields the operations of a JSONL stream, one per non-empty line.
+
+    Each line is either an operation {"AC": "issue" or "revoke", "OB": token}
+    (plus "root": true for root tokens) or a bare capability token to issue.
+    """
+    for number, line in enumerate(fd, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            operation = json.loads(line)
+        except ValueError:
+            raise CapBACClientException(
+                'Invalid operation on line {}: serialization failed'.format(number))
+        if 'OB' not in operation:
+            operation = {'AC': 'issue', 'OB': operation}
+        yield operation
+
+def sign_transactions(keyfile, operations, processes=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields serialized Transactions for the operations, in input order.
+
+    Signing is spread over a pool of `processes` worker processes (one per
+    core by default). Operations are read lazily and at most two chunks per
+    worker are in flight, so inputs and outputs can be streams of any size.
+    """
+    for chunk in _run(_sign_transactions, keyfile, operations, processes, chunk_size):
+        for transaction in chunk:
+            yield transaction
+
+def sign_batches(keyfile, operations, processes=None,
+                 batch_size=MAX_BATCH_TRANSACTIONS):
+    """Yields serialized Batches of `batch_size` operations, in input order.
+
+    Each worker signs the transactions and the header of a whole batch,
+    split further when its transactions exceed MAX_BATCH_BYTES.
+    """
+    for batches in _run(_sign_batch, keyfile, operations, processes, batch_size):
+        for batch in batches:
+            yield batch
+
+def _run(function, keyfile, operations, processes, chunk_size):
+    processes = processes or multiprocessing.cpu_count()
+    operations = iter(operations)
+
+    pool = multiprocessing.Pool(processes, _init_worker, (keyfile,))
+    try:
+        pending = deque()
+        signed = 0
+        start = report = time.time()
+        offset = 0
+        while True:
+            while len(pending) < 2 * processes:
+                chunk = list(islice(operations, chunk_size))
+                if not chunk:
+                    break
+                pending.append((offset, len(chunk), pool.apply_async(function, (chunk,))))
+                offset += len(chunk)
+            if not pending:
+                break
+
+            first, count, result = pending.popleft()
+            output, error = result.get()
+            if error is not None:
+                raise CapBACClientException(
+                    'Invalid operation {}: {}'.format(first + error[0], error[1]))
+            yield output
+
+            signed += count
+            if time.time() - report >= REPORT_INTERVAL:
+                report = time.time()
+                _report(signed, report - start, processes)
+
+        _report(signed, time.time() - start, processes)
+    finally:
+        pool.terminate()
+
+def _report(signed, elapsed, processes):
+    LOGGER.info('Signed %d tokens in %.1fs (%.0f tokens/s, %d processes)',
+                signed, elapsed, signed / elapsed if elapsed else 0, processes)
+
+def _init_worker(keyfile):
+    global _client
+    _client = CapBACLocalClient(keyfile)
+
+def _create_transactions(operations):
+    # (signature, serialized Transaction) pairs
+    transactions = []
+    for index, operation in enumerate(operations):
+        try:
+            action = operation.get('AC')
+            token = operation['OB']
+            if action == 'issue':
+                payload = _client.issue_payload(token, operation.get('root', False))
+            elif action == 'revoke':
+                payload = _client.revoke_payload(token)
+            else:
+                raise CapBACClientException('AC should be issue or revoke')
+            transactions.append(_client.build_transaction(payload, action, token['DE']))
+        except (CapBACClientException, KeyError, TypeError) as err:
+            return None, (index, str(err))
+    return transactions, None
+
+def _sign_transactions(operations):
+    transactions, error = _create_transactions(operations)
+    if error is not None:
+        return None, error
+    return [transaction for _, transaction in transactions], None
+
+def _sign_batch(operations):
+    transactions, error = _create_transactions(operations)
+    if error is not None:
+        return None, error
+    return _client.build_batches(transactions), None
@@ -0,0 +1,151 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import logging
+import random
+import threading
+import time
+
+from cli.capbac_exceptions import CapBACBackpressureException
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 10 # batches in flight at start
+MIN_WINDOW = 1
+MAX_WINDOW = 10000
+DECREASE = 0.5 # window factor on backpressure
+BACKOFF = 0.1 # seconds of the first retry, doubled up to MAX_BACKOFF
+MAX_BACKOFF = 10
+GIVE_UP = 60 # seconds of continuous backpressure before failing
+POLL_WAIT = 5 # seconds of each long-poll of the statuses in flight
+FINAL_STATUSES = {'COMMITTED', 'INVALID'}
+
+class RateController:
+    """AIMD window of batches submitted but not yet committed.
+
+    Submissions block while the window is full. Every batch leaving the
+    PENDING status frees its slot and widens the window by 1/window (about
+    one batch per round trip); a full validator queue (or, with
+    `target_latency`, a batch committed slower than that) halves it, at
+    most once per round trip. Rejected submissions are retried after a
+    jittered exponential backoff. The batches in flight are long-polled
+    together by a background thread.
+    """
+
+    def __init__(self, transport, window=DEFAULT_WINDOW, min_window=MIN_WINDOW,
+                 max_window=MAX_WINDOW, target_latency=None, give_up=GIVE_UP):
+        self._transport = transport
+        self.window = float(window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_latency = target_latency
+        self.give_up = give_up
+
+        self._in_flight = {} # batch id -> submission time
+        self._reserved = 0 # slots of the submissions being sent
+        self._round_trip = 1.0 # smoothed commit latency
+        self._decreased = 0
+        self._condition = threading.Condition()
+        self._poller = None
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight) + self._reserved
+
+    def submit(self, batches):
+        """Submits the batches through the transport, within the window."""
+        with self._condition:
+            while self.in_flight and self.in_flight + len(batches) > self.window:
+                self._condition.wait()
+            self._reserved += len(batches)
+
+        try:
+            response = self._send(batches)
+        except BaseException:
+            with self._condition:
+                self._reserved -= len(batches)
+                self._condition.notify_all()
+            raise
+
+        now = time.time()
+        with self._condition:
+            self._reserved -= len(batches)
+            for batch in batches:
+                self._in_flight[batch.header_signature] = now
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._poll, name='capbac-rate', daemon=True)
+                self._poller.start()
+
+        return response
+
+    def _send(self, batches):
+        deadline = time.time() + self.give_up
+        backoff = BACKOFF
+        while True:
+            try:
+                return self._transport.submit(batches)
+            except CapBACBackpressureException as err:
+                with self._condition:
+                    self._decrease('rejected: {}'.format(err))
+                if time.time() + backoff > deadline:
+                    raise
+                time.sleep(random.uniform(backoff / 2, backoff))
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _poll(self):
+        while True:
+            with self._condition:
+                if not self._in_flight:
+                    self._poller = None
+                    return
+                batch_ids = sorted(self._in_flight)
+
+            try:
+                statuses = self._transport.get_batch_statuses(batch_ids, POLL_WAIT)
+            except BaseException as err:
+                LOGGER.warning('Failed to poll %d batches: %s', len(batch_ids), err)
+                statuses = []
+                time.sleep(POLL_WAIT)
+
+            now = time.time()
+            with self._condition:
+                for entry in statuses:
+                    if entry['status'] in FINAL_STATUSES and entry['id'] in self._in_flight:
+                        self._complete(now - self._in_flight.pop(entry['id']))
+
+                # never seen by the validator (or lost): free their slots
+                for batch_id, submitted in list(self._in_flight.items()):
+                    if now - submitted > self.give_up:
+                        del self._in_flight[batch_id]
+
+                self._condition.notify_all()
+
+    def _complete(self, latency):
+        # called with the condition held
+        self._round_trip = 0.875 * self._round_trip + 0.125 * latency
+        if self.target_latency is not None and latency > self.target_latency:
+            self._decrease('committed in {:.1f}s'.format(latency))
+        else:
+            self.window = min(self.max_window, self.window + 1 / self.window)
+
+    def _decrease(self, reason):
+        # called with the condition held
+        now = time.time()
+        if now - self._decreased < self._round_trip:
+            return
+        self._decreased = now
+        self.window = max(self.min_window, self.window * DECREASE)
+        LOGGER.info('Backpressure (%s), window %.1f', reason, self.window)
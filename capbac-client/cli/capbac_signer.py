@@ -0,0 +1,80 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import os
+import threading
+
+from functools import lru_cache
+
+from sawtooth_signing import create_context
+from sawtooth_signing import CryptoFactory
+from sawtooth_signing import ParseError
+from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
+from sawtooth_signing.secp256k1 import Secp256k1PublicKey
+
+from cli.capbac_exceptions import CapBACClientException
+
+# a single crypto context for the whole process
+CONTEXT = create_context('secp256k1')
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+class CapBACSigner:
+    """secp256k1 signer whose public key is serialized once."""
+
+    def __init__(self, private_key):
+        self._signer = CryptoFactory(CONTEXT).new_signer(private_key)
+        self._public_key = self._signer.get_public_key()
+        self.public_key_hex = self._public_key.as_hex()
+        self.public_key_bytes = self._public_key.as_bytes()
+
+    def get_public_key(self):
+        return self._public_key
+
+    def sign(self, message):
+        return self._signer.sign(message)
+
+def load_signer(keyfile):
+    """Returns the signer for the key file, read only once per process."""
+    path = os.path.realpath(keyfile)
+    with _signers_lock:
+        if path not in _signers:
+            _signers[path] = CapBACSigner(_read_private_key(keyfile))
+        return _signers[path]
+
+def load_signers(keyfiles):
+    return [load_signer(keyfile) for keyfile in keyfiles]
+
+def _read_private_key(keyfile):
+    try:
+        with open(keyfile) as fd:
+            private_key_str = fd.read().strip()
+    except OSError as err:
+        raise CapBACClientException(
+            'Failed to read private key: {}'.format(str(err)))
+
+    try:
+        return Secp256k1PrivateKey.from_hex(private_key_str)
+    except ParseError as e:
+        raise CapBACClientException(
+            'Unable to load private key: {}'.format(str(e)))
+
+@lru_cache(maxsize=1024)
+def _parse_public_key(public_key_hex):
+    return Secp256k1PublicKey.from_hex(public_key_hex)
+
+def verify(signature, message, public_key_hex):
+    return CONTEXT.verify(signature, message, _parse_public_key(public_key_hex))
@@ -0,0 +1,221 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_version import DEFAULT_WAIT
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_TRANSACTIONS = 100 # flushed as soon as this many are queued
+DEFAULT_LINGER = 0.02 # seconds waited for more transactions before flushing
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_PUT_TIMEOUT = 10 # seconds a caller waits for room in the queue
+STATUS_ROUND = 1 # seconds of each long-poll of the batches waited for
+
+class BatchSubmitter:
+    """Groups transactions from many threads into few BatchList posts.
+
+    Callers get back a Future; a background thread flushes the queue when
+    `max_transactions` are pending or when the oldest one waited `linger`
+    seconds. Each transaction is sent in a batch of its own, all in one
+    BatchList: batches are atomic, and an invalid transaction must not
+    fail the unrelated ones queued with it. A second thread long-polls the statuses of the batches sent,
+    and each Future resolves with the ids of the batch holding the
+    transaction, the batch statuses link and the batch status (COMMITTED,
+    INVALID with the message of the transaction, or PENDING after `wait`
+    seconds). With `wait` None, Futures resolve as soon as the batch is
+    accepted, as PENDING. When the queue is full callers block up to
+    `put_timeout` seconds, then fail.
+    """
+
+    def __init__(self, client, max_transactions=DEFAULT_MAX_TRANSACTIONS,
+                 linger=DEFAULT_LINGER, queue_size=DEFAULT_QUEUE_SIZE,
+                 put_timeout=DEFAULT_PUT_TIMEOUT, wait=DEFAULT_WAIT):
+        self._client = client
+        self.max_transactions = max_transactions
+        self.linger = linger
+        self.put_timeout = put_timeout
+        self.wait = wait
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # batch id -> (deadline, link, [(transaction id, future)])
+        self._waiting = {}
+        self._flushed = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(
+            target=self._run, name='capbac-submitter', daemon=True)
+        self._thread.start()
+        self._waiter = None
+        if wait is not None:
+            self._waiter = threading.Thread(
+                target=self._wait, name='capbac-submitter-status', daemon=True)
+            self._waiter.start()
+
+    def issue_from_dict(self, token, is_root):
+        # same checks and cache invalidation as CapBACClient.issue_from_dict
+        transaction = self._client._create_issue_transaction(
+            token, is_root, precheck=self._client._new_precheck())
+        self._client.invalidate(token['DE'])
+        return self.submit(transaction)
+
+    def revoke_from_dict(self, token):
+        transaction = self._client._create_revoke_transaction(token)
+        self._client.invalidate(token['DE'])
+        return self.submit(transaction)
+
+    def submit(self, transaction):
+        future = Future()
+        # checked under the lock of close(), so that nothing is queued after it
+        with self._lock:
+            if self._closed.is_set():
+                raise CapBACClientException('Submitter closed')
+            try:
+                self._queue.put((transaction, future), timeout=self.put_timeout)
+            except queue.Full:
+                raise CapBACClientException('Submission queue full')
+        return future
+
+    def close(self):
+        """Stops accepting transactions, flushes the pending ones and waits
+        for their statuses.
+        """
+        with self._lock:
+            self._closed.set()
+        self._thread.join()
+
+        # never left unresolved
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(CapBACClientException('Submitter closed'))
+
+        with self._condition:
+            self._flushed = True
+            self._condition.notify_all()
+        if self._waiter is not None:
+            self._waiter.join()
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                pending = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            deadline = time.time() + self.linger
+            while len(pending) < self.max_transactions:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        pending.append(self._queue.get(timeout=remaining))
+                    else:
+                        pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._flush(pending)
+
+    def _flush(self, pending):
+        # cancelled futures are dropped before sending
+        pending = [(transaction, future) for transaction, future in pending
+                   if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+
+        try:
+            batches = [self._client._create_batch([transaction])
+                       for transaction, _ in pending]
+            link = json.loads(self._client._submit(batches)).get('link')
+        except BaseException as err:
+            LOGGER.warning('Failed to submit %d transactions: %s', len(pending), err)
+            for _, future in pending:
+                future.set_exception(err)
+            return
+
+        if self.wait is None:
+            for batch, (transaction, future) in zip(batches, pending):
+                future.set_result(_result(
+                    batch.header_signature, transaction.header_signature, link, None))
+            return
+
+        deadline = time.time() + self.wait
+        with self._condition:
+            for batch, (transaction, future) in zip(batches, pending):
+                self._waiting[batch.header_signature] = (
+                    deadline, link, [(transaction.header_signature, future)])
+            self._condition.notify_all()
+
+    def _wait(self):
+        while True:
+            with self._condition:
+                while not self._waiting:
+                    if self._flushed:
+                        return
+                    self._condition.wait()
+                batch_ids = sorted(self._waiting)
+
+            try:
+                for batch_id, status in self._client.iter_batch_statuses(
+                        batch_ids, STATUS_ROUND):
+                    # unknown at the end of a round: polled again
+                    if status['status'] != 'UNKNOWN':
+                        self._resolve(batch_id, status)
+            except CapBACClientException as err:
+                LOGGER.warning('Failed to poll %d batches: %s', len(batch_ids), err)
+                time.sleep(STATUS_ROUND)
+
+            # still pending after `wait` seconds
+            now = time.time()
+            with self._condition:
+                expired = [batch_id for batch_id, (deadline, _, _) in self._waiting.items()
+                           if deadline < now]
+            for batch_id in expired:
+                self._resolve(batch_id, None)
+
+    def _resolve(self, batch_id, status):
+        with self._condition:
+            waiting = self._waiting.pop(batch_id, None)
+        if waiting is None:
+            return
+        _, link, transactions = waiting
+        for transaction_id, future in transactions:
+            future.set_result(_result(batch_id, transaction_id, link, status))
+
+def _result(batch_id, transaction_id, link, status):
+    result = {
+        'batch_id': batch_id,
+        'transaction_id': transaction_id,
+        'link': link,
+        'status': 'PENDING' if status is None else status['status']
+    }
+    if status is not None:
+        for invalid in status['invalid_transactions']:
+            if invalid['id'] == transaction_id:
+                result['message'] = invalid.get('message')
+    return result
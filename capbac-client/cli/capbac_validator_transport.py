@@ -0,0 +1,196 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import json
+import threading
+import time
+import uuid
+
+import zmq
+
+from sawtooth_sdk.protobuf.block_pb2 import BlockHeader
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatus
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatusRequest
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatusResponse
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchSubmitRequest
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchSubmitResponse
+from sawtooth_sdk.protobuf.client_block_pb2 import ClientBlockListRequest
+from sawtooth_sdk.protobuf.client_block_pb2 import ClientBlockListResponse
+from sawtooth_sdk.protobuf.client_list_control_pb2 import ClientPagingControls
+from sawtooth_sdk.protobuf.client_state_pb2 import ClientStateListRequest
+from sawtooth_sdk.protobuf.client_state_pb2 import ClientStateListResponse
+from sawtooth_sdk.protobuf.network_pb2 import PingResponse
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+from cli.capbac_exceptions import CapBACBackpressureException
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_exceptions import CapBACTimeoutException
+from cli.capbac_transport import DEFAULT_TIMEOUT
+
+# the state list response carries the state root (head block id before 1.1)
+_ROOT_FIELD = 'state_root' \
+    if 'state_root' in ClientStateListResponse.DESCRIPTOR.fields_by_name else 'head_id'
+
+def _statuses_link(url, batch_ids):
+    return json.dumps({
+        'link': '{}/batch_statuses?id={}'.format(url, ','.join(batch_ids))
+    })
+
+class ValidatorTransport:
+    """Client requests sent straight to the validator component endpoint.
+
+    Skips the REST API process and its JSON/base64 encoding: requests are
+    the validator's own protobuf messages over zmq DEALER sockets. Each
+    thread has a socket of its own (zmq sockets are not thread safe), so
+    that a long-polled status request doesn't hold up the submissions and
+    reads of other threads. A socket whose request timed out is replaced,
+    so that a late reply can't be taken for the next one.
+    """
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._context = zmq.Context()
+        self._local = threading.local()
+
+    def close(self):
+        # the sockets of all threads
+        self._context.destroy(linger=0)
+
+    def submit(self, batches):
+        response = self._send(
+            Message.CLIENT_BATCH_SUBMIT_REQUEST,
+            ClientBatchSubmitRequest(batches=batches),
+            Message.CLIENT_BATCH_SUBMIT_RESPONSE,
+            ClientBatchSubmitResponse)
+
+        if response.status == ClientBatchSubmitResponse.INVALID_BATCH:
+            raise CapBACClientException('Error 400: invalid batch')
+        if response.status == ClientBatchSubmitResponse.QUEUE_FULL:
+            raise CapBACBackpressureException('Error 429: validator queue full')
+        if response.status != ClientBatchSubmitResponse.OK:
+            raise CapBACClientException('Error 500: batch submission failed')
+
+        return _statuses_link(
+            self.url, [batch.header_signature for batch in batches])
+
+    def iter_pages(self, address, limit):
+        # the following pages are read at the root of the first one
+        root = ''
+        start = ''
+        while True:
+            request = ClientStateListRequest(
+                address=address,
+                paging=ClientPagingControls(start=start, limit=limit))
+            setattr(request, _ROOT_FIELD, root)
+            response = self._send(
+                Message.CLIENT_STATE_LIST_REQUEST, request,
+                Message.CLIENT_STATE_LIST_RESPONSE, ClientStateListResponse)
+
+            if response.status == ClientStateListResponse.NO_RESOURCE:
+                yield getattr(response, _ROOT_FIELD) or None, []
+                return
+            _check_status(response, ClientStateListResponse, 'state list')
+
+            root = getattr(response, _ROOT_FIELD)
+            yield root, [entry.data for entry in response.entries]
+
+            start = response.paging.next
+            if not start:
+                return
+
+    def get_head(self):
+        # tagged like the state pages, so that both can be compared
+        response = self._send(
+            Message.CLIENT_BLOCK_LIST_REQUEST,
+            ClientBlockListRequest(paging=ClientPagingControls(limit=1)),
+            Message.CLIENT_BLOCK_LIST_RESPONSE, ClientBlockListResponse)
+        _check_status(response, ClientBlockListResponse, 'block list')
+
+        if _ROOT_FIELD == 'head_id':
+            return response.head_id
+        return BlockHeader.FromString(response.blocks[0].header).state_root_hash
+
+    def get_batch_statuses(self, batch_ids, wait):
+        response = self._send(
+            Message.CLIENT_BATCH_STATUS_REQUEST,
+            ClientBatchStatusRequest(batch_ids=batch_ids, wait=True, timeout=wait),
+            Message.CLIENT_BATCH_STATUS_RESPONSE, ClientBatchStatusResponse,
+            timeout=self.timeout + wait)
+        _check_status(response, ClientBatchStatusResponse, 'batch status')
+
+        return [
+            {
+                'id': status.batch_id,
+                'status': ClientBatchStatus.Status.Name(status.status),
+                'invalid_transactions': [
+                    {'id': invalid.transaction_id, 'message': invalid.message}
+                    for invalid in status.invalid_transactions
+                ]
+            }
+            for status in response.batch_statuses
+        ]
+
+    def _send(self, message_type, request, response_type, response_class,
+              timeout=None):
+        correlation_id = uuid.uuid4().hex
+        message = Message(
+            correlation_id=correlation_id,
+            message_type=message_type,
+            content=request.SerializeToString()).SerializeToString()
+
+        deadline = time.time() + (timeout or self.timeout)
+        socket = getattr(self._local, 'socket', None)
+        if socket is None:
+            socket = self._context.socket(zmq.DEALER)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(self.url)
+            self._local.socket = socket
+        socket.send_multipart([message])
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not socket.poll(remaining * 1000):
+                socket.close()
+                self._local.socket = None
+                # no reply can't be told from an unreachable endpoint, but
+                # the request may have been received
+                raise CapBACTimeoutException(
+                    'Request to {} timed out'.format(self.url))
+
+            reply = Message.FromString(socket.recv_multipart()[-1])
+            if reply.message_type == Message.PING_REQUEST:
+                socket.send_multipart([Message(
+                    correlation_id=reply.correlation_id,
+                    message_type=Message.PING_RESPONSE,
+                    content=PingResponse().SerializeToString()
+                ).SerializeToString()])
+            elif reply.correlation_id == correlation_id:
+                break
+
+        if reply.message_type != response_type:
+            raise CapBACClientException(
+                'Unexpected reply from {}: {}'.format(
+                    self.url, Message.MessageType.Name(reply.message_type)))
+
+        return response_class.FromString(reply.content)
+
+def _check_status(response, response_class, name):
+    if response.status == response_class.OK:
+        return
+    if response.status == getattr(response_class, 'NOT_READY', None):
+        raise CapBACBackpressureException('Error 503: validator not ready')
+    raise CapBACClientException('Error 500: {} failed ({})'.format(
+        name, response_class.Status.Name(response.status)))
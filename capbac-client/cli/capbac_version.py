@@ -23,6 +23,17 @@ SIGNATURE_LENGTH = 128
 
 REQUEST_ACTIONS = {'GET','POST','PUT','DELETE'}
 
+DEFAULT_WAIT = 60 # seconds a client waits for batches to be committed
+
+# on-chain settings (sawtooth_settings family) bounding each device's state
+SETTINGS_NAMESPACE = '000000'
+
+BUDGET_SETTINGS = {
+    'max_tokens': 'sawtooth.capbac.max_tokens_per_device',
+    'max_bytes': 'sawtooth.capbac.max_bytes_per_device',
+    'max_depth': 'sawtooth.capbac.max_delegation_depth'
+}
+
 PAYLOAD_FORMAT = {
     'AC': {
         'description': 'action',
@@ -31,9 +31,10 @@ setup(
     packages=find_packages(),
     install_requires=[
         'aiohttp',
-        'aiocoap'
+        'aiocoap',
         'colorlog',
         'protobuf',
+        'pyzmq',
         'sawtooth-sdk',
         'sawtooth-signing',
         'PyYAML',
@@ -41,7 +42,8 @@ setup(
     data_files=data_files,
     entry_points={
         'console_scripts': [
-            'capbac = capbac_cli:main_wrapper',
+            'capbac = cli.capbac_cli:main_wrapper',
+            'capbac-remote = cli.capbac_remote:main_wrapper',
         ]
     })
 
@@ -14,6 +14,10 @@
 # ------------------------------------------------------------------------------
 
 __all__ = [
+    'capbac_profiler',
+    'capbac_rules',
+    'capbac_state',
     'capbac_tp',
+    'capbac_validator',
     'version_format'
 ]
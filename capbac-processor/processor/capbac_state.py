@@ -0,0 +1,57 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+from processor.capbac_rules import DeviceState
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024 # bytes of encoded state
+
+class StateCache:
+    """Decoded device entries kept across blocks.
+
+    An entry is only returned if its encoded bytes match the ones just read
+    from the context, so it can never be stale. Least recently used entries
+    are evicted once `max_size` bytes of encoded state are held.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._size = 0
+        self._entries = OrderedDict()
+
+    def get(self, address, data):
+        entry = self._entries.get(address)
+        if entry is not None and entry.data == data:
+            self._entries.move_to_end(address)
+            return entry
+        entry = DeviceState(data)
+        self.put(address, entry)
+        return entry
+
+    def put(self, address, entry):
+        self.evict(address)
+        if entry.size > self.max_size:
+            return
+        self._entries[address] = entry
+        self._size += entry.size
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+    def evict(self, address):
+        entry = self._entries.pop(address, None)
+        if entry is not None:
+            self._size -= entry.size
@@ -0,0 +1,519 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from cli.capbac_builder import TransactionBuilder
+from cli.capbac_builder import encode_batch_list
+from cli.capbac_client import CapBACClient
+from cli.capbac_client import MAX_BATCH_TRANSACTIONS
+from cli.capbac_client import get_batch_ids
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_signer import CONTEXT
+from cli.capbac_signer import CapBACSigner
+from cli.capbac_signer import load_signer
+from cli.capbac_version import FAMILY_NAME
+from cli.capbac_version import FAMILY_VERSION
+
+LOGGER = logging.getLogger(__name__)
+
+OPERATIONS = ('issue', 'revoke', 'validate', 'sign')
+DEFAULT_MIX = {'issue': 1, 'revoke': 1, 'validate': 8, 'sign': 0}
+DEFAULT_DURATION = 10 # seconds
+DEFAULT_BUILD_COUNT = 10000 # transactions of the builder benchmark
+DEFAULT_CONCURRENT = 10000 # validations of the asyncio benchmark
+DEFAULT_REMOTE_COUNT = 20 # signatures of each mode of the daemon benchmark
+SETUP_WAIT = 60 # seconds waited for the delegation tree to be committed
+RESOURCE = 'bench'
+
+def run_bench(url, workers=None, duration=DEFAULT_DURATION, rate=None,
+              mix=None, device=None):
+    """Drives a mix of operations against the ledger and reports latencies.
+
+    A root key and one key per worker are generated; a fresh device gets a
+    root token and one delegated capability per worker. Each worker process
+    then picks operations by weight from `mix` for `duration` seconds, at
+    `rate` operations per second overall (as fast as possible if None).
+    Latencies are measured from the scheduled start of each operation, so
+    a slow system is not hidden by a slower request rate. Issues and
+    revocations are timed up to their commit, their statuses long-polled
+    by a thread of each worker (so latencies have the resolution of a
+    poll); revocations target the worker's oldest token known committed,
+    and are issues while there is none. Validations read the ledger with
+    the state cache disabled.
+    Returns {"operations": {name: count (committed for issues and
+    revocations), errors (failed requests), invalid, pending (not final
+    SETUP_WAIT seconds after the end), throughput and latency percentiles
+    in ms}} plus the run parameters.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    mix = mix or DEFAULT_MIX
+    device = device or 'coap://bench-{:08x}'.format(random.getrandbits(32))
+
+    directory = tempfile.mkdtemp(prefix='capbac-bench-')
+    try:
+        root_keyfile = _write_key(directory, 'root')
+        keyfiles = [_write_key(directory, 'worker{}'.format(i)) for i in range(workers)]
+        capabilities = _setup_tree(url, device, root_keyfile, keyfiles)
+
+        configs = [{
+            'url': url,
+            'keyfile': keyfile,
+            'device': device,
+            'capability': capability,
+            'duration': duration,
+            'rate': rate / workers if rate else None,
+            'mix': mix,
+            'seed': index
+        } for index, (keyfile, capability) in enumerate(zip(keyfiles, capabilities))]
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_run_worker, configs)
+        finally:
+            pool.terminate()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'url': url,
+        'device': device,
+        'workers': workers,
+        'duration': duration,
+        'rate': rate,
+        'operations': _summarize(results, duration)
+    }
+
+def run_async_bench(url, count=DEFAULT_CONCURRENT, device=None):
+    """Starts `count` validations at once through the AsyncCapBACClient.
+
+    The tree of run_bench is set up with a single worker key, whose access
+    tokens are all signed before the clock starts. Returns the throughput,
+    the latency percentiles in ms (from the common start) and the peak of
+    requests in flight.
+    """
+    # aiohttp is only needed here
+    from cli.capbac_async_client import AsyncCapBACClient
+
+    device = device or 'coap://bench-{:08x}'.format(random.getrandbits(32))
+
+    directory = tempfile.mkdtemp(prefix='capbac-bench-')
+    try:
+        root_keyfile = _write_key(directory, 'root')
+        keyfile = _write_key(directory, 'worker')
+        capability, = _setup_tree(url, device, root_keyfile, [keyfile])
+        client = AsyncCapBACClient(url, keyfile, concurrency=count)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    access = {'DE': device, 'AC': 'GET', 'RE': RESOURCE, 'IC': capability}
+    tokens = [client.sign_dict(dict(access)) for _ in range(count)]
+
+    latencies = []
+    errors = []
+    peak = [0]
+
+    async def validate(token, start):
+        try:
+            if not await client.validate_from_dict(token):
+                errors.append('denied')
+            latencies.append(time.time() - start)
+        except CapBACClientException as err:
+            LOGGER.debug('validate failed: %s', err)
+            errors.append(err)
+
+    async def monitor(tasks):
+        while not all(task.done() for task in tasks):
+            peak[0] = max(peak[0], client.in_flight)
+            await asyncio.sleep(0.001)
+
+    async def run():
+        start = time.time()
+        tasks = [asyncio.ensure_future(validate(token, start)) for token in tokens]
+        await asyncio.gather(monitor(tasks), *tasks)
+        elapsed = time.time() - start
+        await client.close()
+        return elapsed
+
+    loop = asyncio.new_event_loop()
+    try:
+        elapsed = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    summary = _summarize([{
+        'latencies': {'validate': latencies}, 'errors': {'validate': len(errors)}
+    }], elapsed)
+    return {
+        'url': url,
+        'device': device,
+        'concurrent': count,
+        'peak_in_flight': peak[0],
+        'seconds': round(elapsed, 3),
+        'operations': summary
+    }
+
+# entry points run in a new interpreter by the daemon benchmark
+_CLI_MAIN = 'from cli.capbac_cli import main_wrapper; main_wrapper()'
+_REMOTE_MAIN = 'from cli.capbac_remote import main_wrapper; main_wrapper()'
+
+def run_remote_bench(url, count=DEFAULT_REMOTE_COUNT):
+    """Compares the CLI with the `capbac serve` daemon on `count` signatures.
+
+    Each signature is timed as a new `capbac sign` process, as a new
+    `capbac-remote sign` process sent to a daemon started here, and as a
+    call over one persistent RemoteClient connection. No ledger is read:
+    the difference is the start up of the CLI. Returns the latency
+    percentiles in ms of each mode.
+    """
+    # the daemon (and its socket server) are only needed here
+    from cli.capbac_daemon import CapBACDaemon
+    from cli.capbac_remote import RemoteClient
+
+    directory = tempfile.mkdtemp(prefix='capbac-bench-')
+    try:
+        keyfile = _write_key(directory, 'worker')
+        path = os.path.join(directory, 'capbac.sock')
+        daemon = CapBACDaemon(path, url, keyfile)
+        server = threading.Thread(target=daemon.serve_forever, daemon=True)
+        server.start()
+
+        token = json.dumps(
+            {'DE': 'coap://bench', 'AC': 'GET', 'RE': RESOURCE, 'IC': _identifier()})
+        # the new interpreters import this package
+        environment = dict(os.environ)
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment['PYTHONPATH'] = os.pathsep.join(
+            [package] + [p for p in [environment.get('PYTHONPATH')] if p])
+
+        commands = {
+            'cli': [sys.executable, '-c', _CLI_MAIN, 'sign', token, '--keyfile', keyfile],
+            'remote': [sys.executable, '-c', _REMOTE_MAIN, '--socket', path,
+                       'sign', token, '--keyfile', keyfile]
+        }
+        report = {}
+        for name, command in sorted(commands.items()):
+            report[name] = _time_calls(count, lambda: subprocess.call(
+                command, env=environment, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL) == 0)
+
+        client = RemoteClient(path)
+        try:
+            report['connection'] = _time_calls(count, lambda: 'error' not in client.call(
+                command='sign', token=token, keyfile=keyfile))
+        finally:
+            client.close()
+
+        daemon.shutdown()
+        daemon.server_close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {'count': count, 'modes': report}
+
+def _time_calls(count, call):
+    # latencies of the successful calls, summarized like a sign operation
+    latencies = []
+    errors = 0
+    start = time.time()
+    for _ in range(count):
+        began = time.time()
+        if call():
+            latencies.append(time.time() - began)
+        else:
+            errors += 1
+    elapsed = time.time() - start
+    return _summarize(
+        [{'latencies': {'sign': latencies}, 'errors': {'sign': errors}}], elapsed)['sign']
+
+def _write_key(directory, name):
+    path = os.path.join(directory, '{}.priv'.format(name))
+    with open(path, 'w') as fd:
+        fd.write(CONTEXT.new_random_private_key().as_hex())
+    return path
+
+def _identifier():
+    return '{:016x}'.format(random.getrandbits(64))
+
+def _token(device, parent, subject, delegation):
+    now = int(time.time())
+    token = {
+        'ID': _identifier(),
+        'DE': device,
+        'AR': [{'AC': 'GET', 'RE': RESOURCE, 'DD': delegation}],
+        'NB': str(now - 60),
+        'NA': str(now + 24 * 3600)
+    }
+    if parent is not None:
+        token['IC'] = parent
+        token['SU'] = subject
+    return token
+
+def _setup_tree(url, device, root_keyfile, keyfiles):
+    # root token of the device, one delegated capability per worker
+    client = CapBACClient(url, root_keyfile)
+    try:
+        root = _token(device, None, None, 1000)
+        children = []
+        for keyfile in keyfiles:
+            subject = load_signer(keyfile).public_key_hex
+            children.append({'token': _token(device, root['ID'], subject, 100)})
+
+        result = client.issue_tree({'token': root, 'root': True, 'children': children})
+        statuses = client.wait_for_commit(
+            sorted({entry['batch_id'] for entry in result['results']}), SETUP_WAIT)
+        for batch_id, status in statuses.items():
+            if status['status'] != 'COMMITTED':
+                raise CapBACClientException(
+                    'Bench setup failed: batch {} {}'.format(batch_id, status['status']))
+
+        return [child['token']['ID'] for child in children]
+    finally:
+        client.close()
+
+def _run_worker(config):
+    random.seed(config['seed'])
+    # validations read the ledger every time (no state cache)
+    client = CapBACClient(config['url'], config['keyfile'], cache_size=0)
+    subject = client._signer.public_key_hex
+    device = config['device']
+    capability = config['capability']
+
+    access = {'DE': device, 'AC': 'GET', 'RE': RESOURCE, 'IC': capability}
+    committed = [] # issued tokens, once committed: the ones revoked
+
+    names = [name for name in OPERATIONS if config['mix'].get(name)]
+    weights = [config['mix'][name] for name in names]
+    latencies = {name: [] for name in OPERATIONS}
+    errors = {name: 0 for name in OPERATIONS}
+    invalid = {name: 0 for name in OPERATIONS}
+
+    # batch id -> (operation, scheduled start, token id), until final
+    pending = {}
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def track():
+        deadline = None
+        while True:
+            with lock:
+                batch_ids = sorted(pending)
+            if not batch_ids:
+                if stopped.is_set():
+                    return
+                time.sleep(0.01)
+                continue
+            if stopped.is_set():
+                deadline = deadline or time.time() + SETUP_WAIT
+                if time.time() > deadline:
+                    return
+            try:
+                for batch_id, status in client.iter_batch_statuses(batch_ids, 1):
+                    if status['status'] == 'UNKNOWN':
+                        continue # polled again
+                    with lock:
+                        name, scheduled, identifier = pending.pop(batch_id)
+                        if status['status'] == 'COMMITTED':
+                            latencies[name].append(time.time() - scheduled)
+                            if name == 'issue':
+                                committed.append(identifier)
+                        else:
+                            invalid[name] += 1
+            except CapBACClientException as err:
+                LOGGER.debug('status poll failed: %s', err)
+                time.sleep(1)
+
+    def submitted(name, scheduled, response, identifier=None):
+        batch_id, = get_batch_ids(response)
+        with lock:
+            pending[batch_id] = (name, scheduled, identifier)
+
+    def issue(scheduled):
+        token = _token(device, capability, subject, 0)
+        submitted('issue', scheduled, client.issue_from_dict(token, False), token['ID'])
+
+    def revoke(scheduled):
+        with lock:
+            identifier = committed.pop(0) if committed else None
+        if identifier is None:
+            # nothing committed to revoke yet: counted as an issue
+            return issue(scheduled)
+        submitted('revoke', scheduled, client.revoke_from_dict({
+            'ID': identifier, 'DE': device, 'RT': 'ICO', 'IC': capability}))
+
+    def validate(scheduled):
+        client.validate_from_dict(client.sign_dict(dict(access)))
+        latencies['validate'].append(time.time() - scheduled)
+
+    def sign(scheduled):
+        client.sign_dict(dict(access))
+        latencies['sign'].append(time.time() - scheduled)
+
+    functions = {'issue': issue, 'revoke': revoke, 'validate': validate, 'sign': sign}
+
+    tracker = threading.Thread(target=track, daemon=True)
+    tracker.start()
+
+    interval = 1 / config['rate'] if config['rate'] else 0
+    start = time.time()
+    scheduled = start
+    while scheduled < start + config['duration']:
+        if interval:
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            scheduled = time.time()
+
+        name = _choose(names, weights)
+        try:
+            functions[name](scheduled)
+        except CapBACClientException as err:
+            LOGGER.debug('%s failed: %s', name, err)
+            with lock:
+                errors[name] += 1
+
+        scheduled += interval
+
+    stopped.set()
+    tracker.join()
+    client.close()
+
+    unresolved = {name: 0 for name in OPERATIONS}
+    for name, _, _ in pending.values():
+        unresolved[name] += 1
+    return {'latencies': latencies, 'errors': errors, 'invalid': invalid,
+            'pending': unresolved}
+
+def _choose(names, weights):
+    # (random.choices needs python 3.6)
+    point = random.uniform(0, sum(weights))
+    for name, weight in zip(names, weights):
+        point -= weight
+        if point <= 0:
+            return name
+    return names[-1]
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def _summarize(results, duration):
+    summary = {}
+    for name in OPERATIONS:
+        values = sorted(
+            latency for result in results
+            for latency in result['latencies'].get(name, ()))
+        errors = sum(result['errors'].get(name, 0) for result in results)
+        invalid = sum(result.get('invalid', {}).get(name, 0) for result in results)
+        pending = sum(result.get('pending', {}).get(name, 0) for result in results)
+        if not values and not errors and not invalid and not pending:
+            continue
+
+        summary[name] = {'count': len(values), 'errors': errors,
+                         'throughput': round(len(values) / duration, 1)}
+        if name in ('issue', 'revoke'):
+            summary[name].update({'invalid': invalid, 'pending': pending})
+        if values:
+            summary[name].update({
+                'p50': round(_percentile(values, 0.5) * 1000, 3),
+                'p99': round(_percentile(values, 0.99) * 1000, 3),
+                'p999': round(_percentile(values, 0.999) * 1000, 3),
+                'max': round(values[-1] * 1000, 3)
+            })
+    return summary
+
+def run_build_bench(count=DEFAULT_BUILD_COUNT, batch_size=MAX_BATCH_TRANSACTIONS):
+    """Times the local building of `count` transactions, without network.
+
+    Compares the protobuf classes with the TransactionBuilder templates for
+    headers, then times signed transactions and the BatchList of their
+    batches. Returns the microseconds per transaction of each step and the
+    transactions per second of the builder.
+    """
+    signer = CapBACSigner(CONTEXT.new_random_private_key())
+    builder = TransactionBuilder(signer)
+    public_key = signer.public_key_hex
+    payload = os.urandom(200)
+    address = hashlib.sha512(payload).hexdigest()[:70]
+
+    def protobuf_header():
+        return TransactionHeader(
+            signer_public_key=public_key,
+            family_name=FAMILY_NAME,
+            family_version=FAMILY_VERSION,
+            inputs=[address],
+            outputs=[address],
+            payload_sha512=hashlib.sha512(payload).hexdigest(),
+            batcher_public_key=public_key,
+            nonce=time.time().hex()).SerializeToString()
+
+    def template_header():
+        return builder.header(payload, [address], [address])
+
+    def protobuf_transactions():
+        transactions = []
+        for _ in range(count):
+            header = protobuf_header()
+            transactions.append(Transaction(
+                header=header, payload=payload, header_signature=signer.sign(header)))
+        batches = []
+        for start in range(0, count, batch_size):
+            chunk = transactions[start:start + batch_size]
+            header = BatchHeader(
+                signer_public_key=public_key,
+                transaction_ids=[t.header_signature for t in chunk]).SerializeToString()
+            batches.append(Batch(
+                header=header, transactions=chunk, header_signature=signer.sign(header)))
+        return BatchList(batches=batches).SerializeToString()
+
+    def template_transactions():
+        transactions = [
+            builder.transaction(payload, [address], [address]) for _ in range(count)]
+        return encode_batch_list(
+            builder.batch(transactions[start:start + batch_size])[1]
+            for start in range(0, count, batch_size))
+
+    report = {'count': count, 'batch_size': batch_size}
+    for name, function, repeat in [
+            ('protobuf_header', protobuf_header, count),
+            ('template_header', template_header, count),
+            ('protobuf_batch_list', protobuf_transactions, 1),
+            ('template_batch_list', template_transactions, 1)]:
+        start = time.time()
+        for _ in range(repeat):
+            function()
+        elapsed = time.time() - start
+        report[name] = round(elapsed / count * 1e6, 2) # us per transaction
+
+    report['transactions_per_second'] = round(1e6 / report['template_batch_list'])
+    return report
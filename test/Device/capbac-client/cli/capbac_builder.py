@@ -0,0 +1,150 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+# Transactions and batches are encoded here byte by byte instead of through
+# the protobuf classes: every field of the sawtooth headers is a string or
+# bytes, so each message is the concatenation of its (tag, length, value)
+# fields, in field number order as the protobuf library writes them. The
+# encoded headers are therefore identical to SerializeToString() ones.
+
+import hashlib
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from cli.capbac_version import FAMILY_NAME
+from cli.capbac_version import FAMILY_VERSION
+
+def _varint(value):
+    data = bytearray()
+    while value > 0x7f:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+def _tag(message_class, name):
+    # key of a length delimited field (wire type 2)
+    return _varint(message_class.DESCRIPTOR.fields_by_name[name].number << 3 | 2)
+
+def _field(tag, value):
+    return tag + _varint(len(value)) + value
+
+def _fields(tag, values):
+    return b''.join(_field(tag, value.encode('utf-8')) for value in values)
+
+_HEADER_BATCHER = _tag(TransactionHeader, 'batcher_public_key')
+_HEADER_DEPENDENCIES = _tag(TransactionHeader, 'dependencies')
+_HEADER_FAMILY_NAME = _tag(TransactionHeader, 'family_name')
+_HEADER_FAMILY_VERSION = _tag(TransactionHeader, 'family_version')
+_HEADER_INPUTS = _tag(TransactionHeader, 'inputs')
+_HEADER_NONCE = _tag(TransactionHeader, 'nonce')
+_HEADER_OUTPUTS = _tag(TransactionHeader, 'outputs')
+_HEADER_PAYLOAD = _tag(TransactionHeader, 'payload_sha512')
+_HEADER_SIGNER = _tag(TransactionHeader, 'signer_public_key')
+
+_TRANSACTION_HEADER = _tag(Transaction, 'header')
+_TRANSACTION_SIGNATURE = _tag(Transaction, 'header_signature')
+_TRANSACTION_PAYLOAD = _tag(Transaction, 'payload')
+
+_BATCH_HEADER_SIGNER = _tag(BatchHeader, 'signer_public_key')
+_BATCH_HEADER_TRANSACTIONS = _tag(BatchHeader, 'transaction_ids')
+
+_BATCH_HEADER = _tag(Batch, 'header')
+_BATCH_SIGNATURE = _tag(Batch, 'header_signature')
+_BATCH_TRANSACTIONS = _tag(Batch, 'transactions')
+
+_BATCH_LIST_BATCHES = _tag(BatchList, 'batches')
+
+class TransactionBuilder:
+    """Builds the transactions and batches signed by one key.
+
+    The fields that only depend on the signer and the family (its name,
+    version, public keys) are encoded once; each transaction only encodes
+    its addresses, nonce and payload hash around them. The payload is
+    hashed and copied once, into the serialized transaction.
+    """
+
+    def __init__(self, signer, family_name=FAMILY_NAME, family_version=FAMILY_VERSION):
+        self._signer = signer
+        public_key = signer.public_key_hex.encode('utf-8')
+
+        self._batcher = _field(_HEADER_BATCHER, public_key)
+        self._family = _field(_HEADER_FAMILY_NAME, family_name.encode('utf-8')) \
+            + _field(_HEADER_FAMILY_VERSION, family_version.encode('utf-8'))
+        self._signer_field = _field(_HEADER_SIGNER, public_key)
+        self._batch_signer = _field(_BATCH_HEADER_SIGNER, public_key)
+
+    def header(self, payload, inputs, outputs, dependencies=(), batcher=None,
+               nonce=None):
+        """Serialized TransactionHeader of the payload."""
+        if nonce is None:
+            nonce = time.time().hex()
+        return b''.join((
+            self._batcher if batcher is None
+            else _field(_HEADER_BATCHER, batcher.encode('utf-8')),
+            _fields(_HEADER_DEPENDENCIES, dependencies),
+            self._family,
+            _fields(_HEADER_INPUTS, inputs),
+            _field(_HEADER_NONCE, nonce.encode('utf-8')),
+            _fields(_HEADER_OUTPUTS, outputs),
+            _field(_HEADER_PAYLOAD, hashlib.sha512(payload).hexdigest().encode('utf-8')),
+            self._signer_field))
+
+    def transaction(self, payload, inputs, outputs, dependencies=(), batcher=None):
+        """Returns the signature (id) and the serialized Transaction."""
+        header = self.header(payload, inputs, outputs, dependencies, batcher)
+        signature = self._signer.sign(header)
+        return signature, b''.join((
+            _field(_TRANSACTION_HEADER, header),
+            _field(_TRANSACTION_SIGNATURE, signature.encode('utf-8')),
+            _field(_TRANSACTION_PAYLOAD, payload)))
+
+    def batch_header(self, transaction_ids):
+        """Serialized BatchHeader of the transactions."""
+        return self._batch_signer + _fields(_BATCH_HEADER_TRANSACTIONS, transaction_ids)
+
+    def batch(self, transactions):
+        """Returns the signature (id) and the serialized Batch of the
+        (signature, serialized Transaction) pairs.
+        """
+        header = self.batch_header([signature for signature, _ in transactions])
+        signature = self._signer.sign(header)
+        parts = [
+            _field(_BATCH_HEADER, header),
+            _field(_BATCH_SIGNATURE, signature.encode('utf-8'))
+        ]
+        for _, transaction in transactions:
+            parts.append(_BATCH_TRANSACTIONS)
+            parts.append(_varint(len(transaction)))
+            parts.append(transaction)
+        return signature, b''.join(parts)
+
+def encode_batch_list(batches):
+    """Serialized BatchList of serialized Batches, built in one allocation.
+
+    Also the content of a ClientBatchSubmitRequest, whose batches are the
+    same field.
+    """
+    parts = []
+    for batch in batches:
+        parts.append(_BATCH_LIST_BATCHES)
+        parts.append(_varint(len(batch)))
+        parts.append(batch)
+    return b''.join(parts)
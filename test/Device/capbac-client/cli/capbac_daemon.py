@@ -0,0 +1,139 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from cli.capbac_client import CapBACClient
+from cli.capbac_client import get_batch_ids
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_remote import DEFAULT_SOCKET
+
+LOGGER = logging.getLogger(__name__)
+
+class CapBACDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves CLI commands on a Unix socket from one warm process.
+
+    Each connection sends JSON requests, one per line, and reads one JSON
+    response per line: {"output": text printed by the CLI} plus "error" if
+    the command failed. Clients (sessions, caches and keys) are kept per
+    URL and key file for the life of the daemon. The socket is only
+    accessible to its owner, since commands are signed with its keys.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, url, keyfile):
+        self.path = path
+        self.url = url
+        self.keyfile = keyfile
+        self._clients = {}
+        self._lock = threading.Lock()
+
+        if os.path.lexists(path):
+            _remove_stale_socket(path)
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def server_bind(self):
+        # created owner only (0600): never reachable by others, even briefly
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def get_client(self, url=None, keyfile=None, precheck=False):
+        key = (url or self.url, keyfile or self.keyfile, precheck)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = CapBACClient(
+                    url=key[0], keyfile=key[1], precheck=precheck)
+            return self._clients[key]
+
+    def handle_command(self, request):
+        client = self.get_client(
+            request.get('url'), request.get('keyfile'), request.get('precheck', False))
+        command = request.get('command')
+
+        if command == 'validate':
+            response = client.validate(request['token'])
+            return {'output': '{"authorized": %s}' % str(response).lower()}
+        if command == 'sign':
+            return {'output': client.sign(request['token'])}
+        if command == 'list':
+            return {'output': str(client.list(request['device']))}
+        if command == 'issue':
+            response = client.issue(request['token'], request.get('root', False))
+            return _submission_result(client, response, request.get('wait'))
+        if command == 'revoke':
+            response = client.revoke(request['token'])
+            return _submission_result(client, response, request.get('wait'))
+
+        raise CapBACClientException('Invalid command: {}'.format(command))
+
+def _submission_result(client, response, wait):
+    # same output as the CLI (statuses added when waiting)
+    if wait is None:
+        return {'output': response}
+
+    statuses = client.wait_for_commit(get_batch_ids(response), wait)
+    output = json.loads(response)
+    output['statuses'] = statuses
+    result = {'output': json.dumps(output, indent=4, sort_keys=True)}
+
+    for batch_id, status in statuses.items():
+        if status['status'] != 'COMMITTED':
+            result['error'] = "Batch {} {}".format(batch_id, status['status'])
+            break
+
+    return result
+
+def _remove_stale_socket(path):
+    # left by a daemon that didn't shut down; a live one is not replaced
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise CapBACClientException('{} exists and is not a socket'.format(path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise CapBACClientException(
+        'A capbac daemon is already listening on {}'.format(path))
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                result = self.server.handle_command(json.loads(line.decode('utf-8')))
+            except (CapBACClientException, KeyError, ValueError) as err:
+                result = {'error': str(err)}
+            except BaseException as err:
+                LOGGER.exception('Command failed')
+                result = {'error': repr(err)}
+            self.wfile.write((json.dumps(result) + '\n').encode('utf-8'))
+            self.wfile.flush()
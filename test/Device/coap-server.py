@@ -12,6 +12,16 @@ from colorlog import ColoredFormatter # version 2.6
 
 from subprocess import check_output
 
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'capbac-client'))
+
+from cli.capbac_async_client import AsyncCapBACClient
+from cli.capbac_cli import DEFAULT_URL
+
+# validations run on the event loop instead of spawning `capbac validate`
+client = AsyncCapBACClient(url=DEFAULT_URL)
+
 def print(string:str): # true printf() debugging
     logging.getLogger(__name__).debug(msg=string)
 
@@ -34,9 +44,9 @@ class SimpleResource(resource.Resource):
         try:
             validation_json = json.loads(validation)
             assert validation_json["AC"] == requested_action , "Invalid Token"
-            result = check_output(['capbac','validate',validation]).decode("utf-8")
+            result = await client.validate(validation)
             print('Validation result: %s' % result)
-            assert json.loads(result)['authorized'], "Unauthorized"
+            assert result, "Unauthorized"
         except Exception as e:
             print(e)
             return aiocoap.Message(code=aiocoap.UNAUTHORIZED)
@@ -55,9 +65,9 @@ class SimpleResource(resource.Resource):
         try:
             validation_json = json.loads(validation)
             assert validation_json["AC"] == requested_action , "Invalid Token"
-            result = check_output(['capbac','validate',validation]).decode("utf-8")
+            result = await client.validate(validation)
             print('Validation result: %s' % result)
-            assert json.loads(result)['authorized'], "Unauthorized"
+            assert result, "Unauthorized"
         except Exception as e:
             print(e)
             return aiocoap.Message(code=aiocoap.UNAUTHORIZED)
@@ -103,9 +113,9 @@ class TimeResource(resource.ObservableResource):
         try:
             validation_json = json.loads(validation)
             assert validation_json["AC"] == requested_action , "Invalid Token"
-            result = check_output(['capbac','validate',validation]).decode("utf-8")
+            result = await client.validate(validation)
             print('Validation result: %s' % result)
-            assert json.loads(result)['authorized'], "Unauthorized"
+            assert result, "Unauthorized"
         except Exception as e:
             print(e)
             return aiocoap.Message(code=aiocoap.UNAUTHORIZED)
@@ -170,14 +180,8 @@ def main():
     try:
 
         print("Issuing root token...")
-        response = check_output(["capbac","issue","--root",json.dumps(capability_token)]).decode("utf-8") 
-        link = json.loads(response)["link"]
-
-        time.sleep(5)
-
-        print('Checking result...')
-        response = check_output(["curl","--silent",link]).decode("utf-8")
-        status = json.loads(response)["data"][0]["status"]
+        response = check_output(["capbac","issue","--root","--wait","60",json.dumps(capability_token)]).decode("utf-8")
+        status = list(json.loads(response)["statuses"].values())[0]["status"]
 
         if(status == "COMMITTED"):
             print("Root token committed.")
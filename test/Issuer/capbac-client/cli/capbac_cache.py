@@ -0,0 +1,85 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import threading
+import time
+
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024 # bytes of encoded state
+DEFAULT_MAX_STALENESS = 1 # seconds an entry is trusted without checking the head
+
+class CachedState:
+    def __init__(self, state, head, size):
+        self.state = state
+        self.head = head
+        self.size = size
+        self.checked = time.time()
+
+class DeviceStateCache:
+    """Decoded device states tagged with the head block they were read at.
+
+    Entries younger than `max_staleness` seconds are returned as they are;
+    older ones are only valid if the head block did not change since (the
+    caller checks it and calls `refresh`). Least recently used entries are
+    evicted once `max_size` bytes of encoded state are held.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE,
+                 max_staleness=DEFAULT_MAX_STALENESS):
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device):
+        with self._lock:
+            entry = self._entries.get(device)
+            if entry is not None:
+                self._entries.move_to_end(device)
+            return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry.checked <= self.max_staleness
+
+    def refresh(self, entry):
+        entry.checked = time.time()
+
+    def put(self, device, state, head, size):
+        entry = CachedState(state, head, size)
+        with self._lock:
+            self._pop(device)
+            if size > self.max_size:
+                return entry
+            self._entries[device] = entry
+            self._size += size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+        return entry
+
+    def invalidate(self, device=None):
+        with self._lock:
+            if device is None:
+                self._entries.clear()
+                self._size = 0
+            else:
+                self._pop(device)
+
+    def _pop(self, device):
+        entry = self._entries.pop(device, None)
+        if entry is not None:
+            self._size -= entry.size
@@ -17,4 +17,17 @@ class CapBACCliException(Exception):
     pass
 
 class CapBACClientException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class CapBACBackpressureException(CapBACClientException):
+    """The validator queue is full (or the validator not ready): retry later."""
+    pass
+
+class CapBACConnectionException(CapBACClientException):
+    """The endpoint could not be reached (or timed out)."""
+    pass
+
+class CapBACTimeoutException(CapBACConnectionException):
+    """The request was sent but not answered in time: it may have been
+    processed."""
+    pass
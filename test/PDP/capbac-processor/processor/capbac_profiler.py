@@ -0,0 +1,119 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_RATE = 0.01 # fraction of profiled apply calls
+DEFAULT_INTERVAL = 0.001 # seconds between stack samples
+
+class ApplyProfiler:
+    """Opt-in sampling profiler for CapBACTransactionHandler.apply.
+
+    A fraction of the apply calls is profiled by sampling the stack of the
+    calling thread from a background thread. Each profile is written to its
+    own file in the collapsed stack format read by flamegraph.pl, with a
+    first frame holding the labels (device address, action, token count).
+    """
+
+    def __init__(self, directory, rate=DEFAULT_RATE,
+                 interval=DEFAULT_INTERVAL, enabled=False):
+        self.directory = directory
+        self.rate = rate
+        self.interval = interval
+        self.enabled = enabled
+
+        # one sampler thread for every profiled call in progress
+        self._targets = {} # thread id -> stack counts
+        self._condition = threading.Condition()
+        self._sampler = None
+
+    def toggle(self, *args):
+        # also used as signal handler
+        self.enabled = not self.enabled
+        LOGGER.warning('Profiling %s', 'enabled' if self.enabled else 'disabled')
+
+    def sample(self):
+        return self.enabled and random.random() < self.rate
+
+    @contextmanager
+    def profile(self):
+        labels = {}
+        stacks = Counter()
+        target = threading.current_thread().ident
+
+        with self._condition:
+            self._targets[target] = stacks
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name='capbac-profiler', daemon=True)
+                self._sampler.start()
+            self._condition.notify()
+
+        start = time.time()
+        try:
+            yield labels
+        finally:
+            with self._condition:
+                del self._targets[target]
+            # calls shorter than a sample leave nothing to write
+            if stacks:
+                self._write(labels, stacks, time.time() - start)
+
+    def _sample(self):
+        # first sample as soon as a call starts, then one per interval
+        while True:
+            with self._condition:
+                while not self._targets:
+                    self._condition.wait()
+                frames = sys._current_frames()
+                for target, stacks in self._targets.items():
+                    frame = frames.get(target)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+                del frames
+            time.sleep(self.interval)
+
+    def _write(self, labels, stacks, elapsed):
+        label = 'apply address={} action={} tokens={}'.format(
+            labels.get('address'), labels.get('action'), labels.get('tokens'))
+        filename = os.path.join(self.directory, 'capbac-{:.6f}-{}-{}.folded'.format(
+            time.time(), labels.get('action'), labels.get('address')))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(filename, 'w') as fd:
+                for stack, count in stacks.items():
+                    fd.write('{};{} {}\n'.format(label, stack, count))
+        except OSError as err:
+            LOGGER.error('Failed to write profile: %s', err)
+            return
+        LOGGER.info('Profiled %s in %.3fs: %s', label, elapsed, filename)
+
+def _collapse(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
@@ -15,6 +15,9 @@
 
 import sys
 import argparse
+import os
+import signal
+import tempfile
 
 import logging
 import hashlib
@@ -22,6 +25,8 @@ import hashlib
 import cbor
 import time
 
+from functools import lru_cache
+
 from sawtooth_signing import create_context
 from sawtooth_signing.secp256k1 import Secp256k1PublicKey
 
@@ -34,12 +39,50 @@ from sawtooth_sdk.processor.log import log_configuration
 from sawtooth_sdk.processor.config import get_log_config
 from sawtooth_sdk.processor.config import get_log_dir
 
+from processor.capbac_profiler import ApplyProfiler
+from processor.capbac_profiler import DEFAULT_RATE
+from processor.capbac_rules import BUDGET_ADDRESSES
+from processor.capbac_rules import DelegationError
+from processor.capbac_rules import DeviceState
+from processor.capbac_rules import check_issue
+from processor.capbac_rules import format_rights
+from processor.capbac_rules import parse_budget_setting
+from processor.capbac_state import DEFAULT_CACHE_SIZE
+from processor.capbac_state import StateCache
 from processor.capbac_version import *
 
 LOGGER = logging.getLogger(__name__)
 
+class _SampledLog:
+    """Structured log record emitted once every `rate` calls.
+
+    Nothing is formatted unless the record is actually emitted: the field
+    values are only rendered by the logging handler.
+    """
+
+    rate = 1
+
+    def __init__(self, level, event, *fields):
+        self._level = level
+        self._format = event + ''.join(' {}=%s'.format(field) for field in fields)
+        self._calls = 0
+
+    def __call__(self, *values):
+        if not LOGGER.isEnabledFor(self._level):
+            return
+        self._calls += 1
+        if self._calls % _SampledLog.rate == 0:
+            LOGGER.log(self._level, self._format, *values)
+
+_LOG_ISSUE = _SampledLog(logging.INFO, 'issue', 'id', 'parent', 'tokens')
+_LOG_REVOKE = _SampledLog(logging.INFO, 'revoke', 'id', 'type', 'tokens')
+_LOG_REVOKED = _SampledLog(logging.INFO, 'revoked', 'id', 'tokens')
+
 VALIDATOR_DEFAULT_URL = 'tcp://validator:4004'
 
+# a single crypto context for the whole process
+_CONTEXT = create_context('secp256k1')
+
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
 
@@ -51,7 +94,15 @@ def _get_address(device):
     device_address = _sha512(device.encode('utf-8'))[64:]
     return prefix + device_address
 
+# raw setting entries are parsed once and reused until their value changes
+_budget_cache = {}
+
 class CapBACTransactionHandler(TransactionHandler):
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE, profiler=None):
+        # decoded device entries are reused across blocks
+        self._cache = StateCache(cache_size)
+        self._profiler = profiler
+
     @property
     def family_name(self):
         return FAMILY_NAME
@@ -65,14 +116,33 @@ class CapBACTransactionHandler(TransactionHandler):
         return [_get_prefix()]
 
     def apply(self, transaction, context):
+        if self._profiler is not None and self._profiler.sample():
+            with self._profiler.profile() as labels:
+                self._apply(transaction, context, labels)
+        else:
+            self._apply(transaction, context)
+
+    def _apply(self, transaction, context, labels=None):
         action, obj, device, capability, sender = _unpack_and_verify(transaction)
 
         # State retrival and update
-        state = _get_state_data(device, context)
+        address = _get_address(device)
+        state, budget = _get_state_data(
+            address, action, transaction.header.inputs, context, self._cache)
 
-        updated = _do_capbac(action, obj, capability, sender, state)
+        if labels is not None:
+            labels.update(address=address, action=action, tokens=len(state.tokens))
 
-        _set_state_data(device, updated, context)
+        try:
+            updated = _do_capbac(action, obj, capability, sender, state, budget)
+            self._cache.put(address, _set_state_data(address, updated, context))
+        except InvalidTransaction:
+            # always raised before the entry is modified
+            raise
+        except:
+            # the cached entry may have been modified before failing
+            self._cache.evict(address)
+            raise
 
 def _unpack_and_verify(transaction):
 
@@ -127,10 +197,14 @@ def _unpack_and_verify(transaction):
 
     return action, obj, device, capability, sender_key_str
 
+@lru_cache(maxsize=1024)
+def _parse_public_key(public_key_hex):
+    return Secp256k1PublicKey.from_hex(public_key_hex)
+
 def _check_signature(obj,signature,sender_key_str):
-    publicKey = Secp256k1PublicKey.from_hex(sender_key_str)
+    publicKey = _parse_public_key(sender_key_str)
     token_serialized = str(cbor.dumps(obj,sort_keys=True)).encode('utf-8')
-    if not create_context('secp256k1').verify(signature,token_serialized,publicKey):
+    if not _CONTEXT.verify(signature,token_serialized,publicKey):
         raise InvalidTransaction('Invalid signature.')
 
 def _check_format(dictionary,name,dictionary_format,subset=None):
@@ -168,22 +242,56 @@ def _check_format(dictionary,name,dictionary_format,subset=None):
         if label not in subset:
             raise InvalidTransaction("Invalid {}: unexpected label {}".format(name,label))
 
-def _get_state_data(device, context):
-    address = _get_address(device)
+def _get_state_data(address, action, inputs, context, cache):
+    # only issues read the budget settings, fetched in the same round trip,
+    # and only those declared as inputs: earlier issues only declare the
+    # device address, and are applied without limits as they were then
+    addresses = [address]
+    if action == 'issue':
+        addresses += [
+            setting for setting in BUDGET_ADDRESSES.values()
+            if _is_declared(setting, inputs)
+        ]
+
+    state_entries = {
+        entry.address: entry.data
+        for entry in context.get_state(addresses)
+    }
 
-    state_entries = context.get_state([address])
+    budget = _get_budget(state_entries)
 
     try:
-        return cbor.loads(state_entries[0].data)
-    except IndexError:
-        return {}
+        return cache.get(address, state_entries.get(address, b'')), budget
     except:
         raise InternalError('Failed to load state data')
 
+def _is_declared(address, inputs):
+    # inputs may be address prefixes
+    return any(address.startswith(prefix) for prefix in inputs)
+
+def _get_budget(state_entries):
+    budget = {}
+    for name, address in BUDGET_ADDRESSES.items():
+        data = state_entries.get(address)
+        if data is None:
+            budget[name] = None
+            continue
+        key = (name, data)
+        if key not in _budget_cache:
+            if len(_budget_cache) > 64:
+                _budget_cache.clear()
+            _budget_cache[key] = _parse_budget_setting(BUDGET_SETTINGS[name], data)
+        budget[name] = _budget_cache[key]
+    return budget
+
+def _parse_budget_setting(key, data):
+    try:
+        return parse_budget_setting(key, data)
+    except ValueError as err:
+        raise InternalError(str(err))
 
-def _set_state_data(device, state, context):
-    address = _get_address(device)
 
+def _set_state_data(address, state, context):
     encoded = cbor.dumps(state)
 
     addresses = context.set_state({address: encoded})
@@ -191,102 +299,45 @@ def _set_state_data(device, state, context):
     if not addresses:
         raise InternalError('State error')
 
+    return DeviceState(encoded, state)
+
 
-def _do_capbac(action, obj, capability, sender, state):
+def _do_capbac(action, obj, capability, sender, state, budget):
     if action == 'issue':
-        return _do_issue(obj, capability, sender, state)
+        return _do_issue(obj, capability, sender, state, budget)
     elif action == 'revoke':
         return _do_revoke(obj, capability, sender, state)
     else:
         raise InternalError('Unandled action: {}'.format(action))
 
 
-def _do_issue(token, parent, subject, state):
+def _do_issue(token, parent, subject, entry, budget):
+    state = entry.tokens
     identifier = token.pop('ID')
-    msg = 'Issuing capbabiltity token with ID: {}'.format(identifier)
-    LOGGER.info(msg)
-
-    if parent == None and state != {}:
-        raise InvalidTransaction(
-            'Cannot issue: root token can only be issued once'
-            .format(identifier))    
-
-    if identifier in state:
-        raise InvalidTransaction(
-            'Cannot issue: capability token with ID = {} already exists'
-            .format(identifier))
-
-    now = int(time.time())
-
-    LOGGER.debug('Checking authorization')
-    # check authorization
-    if parent != None:
-        if parent not in state:
-            raise InvalidTransaction(
-                'Cannot issue: no parent capability token with ID = {}'.format(parent))
-        if state[parent]['SU'] != subject:
-            raise InvalidTransaction('Cannot issue: issuer is not the subject of parent capability')
+    _LOG_ISSUE(identifier, parent, len(state))
 
     LOGGER.debug('Reformatting access rights')
     # reformat access rights
-    new_format = {}
-    for access_right in token['AR']:
-        new_format.setdefault(access_right['RE'],{})
-        new_format[access_right['RE']].update({access_right['AC']:access_right['DD']})
-    token['AR'] = new_format
-
-    LOGGER.debug('Checking delegation chain')
-    # delegation chain check
-    current_token = token
-    while parent != None:
-        if parent not in state:
-            raise InvalidTransaction(
-                'Cannot issue: no parent capability token with ID = {}'.format(parent))
-        parent_token = state[parent]
-
-        # check time interval
-        if now >= int(parent_token['NA']):
-            raise InvalidTransaction(
-                'Cannot issue: parent capability token with ID = {} expired'
-                .format(parent))
-        if now < int(parent_token['NB']):
-            raise InvalidTransaction(
-                'Cannot issue: capability token with ID = {} still not active'
-                .format(parent))
-
-        # check access rights
-        for resource in current_token["AR"]:
-            if resource not in parent_token["AR"]:
-                raise InvalidTransaction(
-                    'Cannot issue: resource {} not authorized in parent token ID = {}'
-                    .format(resource, parent))
-            for action in current_token["AR"][resource]:
-                if action not in parent_token["AR"][resource]:
-                    raise InvalidTransaction(
-                        'Cannot issue: action {} not authorized for resource {} in parent token ID = {}'
-                        .format(action,resource, parent))
-                if not current_token["AR"][resource][action] < parent_token["AR"][resource][action]:
-                    raise InvalidTransaction(
-                        'Cannot issue: delegation should be less than parent for action {},\
-                         resource {}, parent token ID = {}'
-                        .format(action,resource, parent))
-
-        # next
-        current_token = parent_token
-        parent = current_token['IC']
+    token['AR'] = format_rights(token['AR'])
 
     # version is already checked and not required anymore
     token.pop('VR')
 
+    LOGGER.debug('Checking delegation chain')
+    try:
+        check_issue(identifier, token, parent, subject, entry, budget, int(time.time()))
+    except DelegationError as err:
+        raise InvalidTransaction(str(err))
+
     state[identifier] = token
 
     return state
 
 
-def _do_revoke(revocation, capability, revoker, state):
+def _do_revoke(revocation, capability, revoker, entry):
+    state = entry.tokens
     identifier = revocation['ID']
-    msg = 'Revoking capbabiltity token with ID: {}'.format(identifier)
-    LOGGER.info(msg)
+    _LOG_REVOKE(identifier, revocation['RT'], len(state))
 
     # check existence of target
     if identifier not in state:
@@ -345,27 +396,21 @@ def _do_revoke(revocation, capability, revoker, state):
             raise InvalidTransaction(
                 'Cannot revoke: invalid revocation type for root capability')
         else:
-            for token in state: # assign childs to grampa
-                if state[token]['IC'] == identifier:
-                    state[token]['IC'] = state[identifier]['IC']
+            for token in entry.children.get(identifier, ()): # assign childs to grampa
+                state[token]['IC'] = state[identifier]['IC']
     else:
         try:
-            state =_recursively_remove_childs(state, identifier)
+            for token in entry.descendants(identifier):
+                state.pop(token)
         except Exception as e:
-            LOGGER.error(state)
-            pass
+            LOGGER.error(
+                'Failed to remove descendants of %s (%d tokens): %s',
+                identifier, len(state), e)
     if revocation_type != 'DCO': # Dependant Capability Only
         state.pop(identifier)
 
-    LOGGER.info('Token removed.')
-
-    return state
+    _LOG_REVOKED(identifier, len(state))
 
-def _recursively_remove_childs(state, parent):
-    for token in set(state):
-        if state[token]['IC'] == parent:
-            state = _recursively_remove_childs(state, token)
-            state.pop(token)
     return state
 
 def parse_args(args):
@@ -377,6 +422,34 @@ def parse_args(args):
         default=VALIDATOR_DEFAULT_URL,
         help='Endpoint for the validator connection')
 
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help='Bytes of device state kept decoded across blocks')
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Start with apply profiling enabled (toggled by SIGUSR1)')
+
+    parser.add_argument(
+        '--profile-rate',
+        type=float,
+        default=DEFAULT_RATE,
+        help='Fraction of apply calls profiled')
+
+    parser.add_argument(
+        '--profile-dir',
+        default=os.path.join(tempfile.gettempdir(), 'capbac-profiles'),
+        help='Directory for the collapsed stack profiles')
+
+    parser.add_argument(
+        '--log-sample',
+        type=int,
+        default=1,
+        help='Log one out of N per-transaction messages')
+
     parser.add_argument('-v', '--verbose',
                         action='count',
                         default=2,
@@ -415,9 +488,16 @@ def main(args=None):
 
         init_console_logging(verbose_level=opts.verbose)
 
+        _SampledLog.rate = max(opts.log_sample, 1)
+
         # The prefix should eventually be looked up from the
         # validator's namespace registry.
-        handler = CapBACTransactionHandler()
+        profiler = ApplyProfiler(
+            opts.profile_dir, rate=opts.profile_rate, enabled=opts.profile)
+        signal.signal(signal.SIGUSR1, profiler.toggle)
+
+        handler = CapBACTransactionHandler(
+            cache_size=opts.cache_size, profiler=profiler)
 
         processor.add_handler(handler)
 
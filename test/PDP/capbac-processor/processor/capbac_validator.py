@@ -0,0 +1,245 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import sys
+import argparse
+import logging
+import hashlib
+
+import zmq
+
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_sdk.processor.log import init_console_logging
+from sawtooth_sdk.protobuf.block_pb2 import Block
+from sawtooth_sdk.protobuf.block_pb2 import BlockHeader
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatus
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatusRequest
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchStatusResponse
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchSubmitRequest
+from sawtooth_sdk.protobuf.client_batch_submit_pb2 import ClientBatchSubmitResponse
+from sawtooth_sdk.protobuf.client_block_pb2 import ClientBlockListResponse
+from sawtooth_sdk.protobuf.client_list_control_pb2 import ClientPagingResponse
+from sawtooth_sdk.protobuf.client_state_pb2 import ClientStateListRequest
+from sawtooth_sdk.protobuf.client_state_pb2 import ClientStateListResponse
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+from processor.capbac_tp import CapBACTransactionHandler
+
+LOGGER = logging.getLogger(__name__)
+
+LOCAL_DEFAULT_URL = 'tcp://127.0.0.1:4004'
+
+# the state list response carries the state root (head block id before 1.1)
+_ROOT_FIELD = 'state_root' \
+    if 'state_root' in ClientStateListResponse.DESCRIPTOR.fields_by_name else 'head_id'
+
+class _Entry:
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+class _Context:
+    # transaction context over the pending changes of a batch
+    def __init__(self, state, changes, header):
+        self._state = state
+        self._changes = changes
+        self._inputs = header.inputs
+        self._outputs = header.outputs
+
+    def get_state(self, addresses, timeout=None):
+        entries = []
+        for address in addresses:
+            if not address.startswith(tuple(self._inputs)):
+                raise InvalidTransaction(
+                    'Address not in the inputs: {}'.format(address))
+            data = self._changes.get(address, self._state.get(address))
+            if data:
+                entries.append(_Entry(address, data))
+        return entries
+
+    def set_state(self, entries, timeout=None):
+        for address in entries:
+            if not address.startswith(tuple(self._outputs)):
+                raise InvalidTransaction(
+                    'Address not in the outputs: {}'.format(address))
+        self._changes.update(entries)
+        return list(entries)
+
+class LocalValidator:
+    """In-process stand-in for the validator component endpoint.
+
+    Answers the client requests used by the validator transport (batch
+    submit and status, state list, head block) over a zmq ROUTER socket.
+    Batches are applied with the transaction handlers as soon as they are
+    submitted, each one in its own block; there is no consensus, no
+    signature check and only the current state can be read.
+    """
+
+    def __init__(self, url=LOCAL_DEFAULT_URL, handlers=None):
+        self.url = url
+        if handlers is None:
+            handlers = [CapBACTransactionHandler()]
+        self._handlers = {
+            (handler.family_name, version): handler
+            for handler in handlers for version in handler.family_versions
+        }
+        self._state = {}
+        self._statuses = {}
+        self._head = hashlib.sha512(b'genesis').hexdigest()
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.ROUTER)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.bind(url)
+
+    def close(self):
+        self._socket.close()
+        self._context.term()
+
+    def serve(self, requests=None):
+        """Answers `requests` requests, forever if None."""
+        served = 0
+        while requests is None or served < requests:
+            identity, data = self._socket.recv_multipart()
+            request = Message.FromString(data)
+            response_type, response = self._handle(request)
+            self._socket.send_multipart([identity, Message(
+                correlation_id=request.correlation_id,
+                message_type=response_type,
+                content=response.SerializeToString()
+            ).SerializeToString()])
+            served += 1
+
+    def _handle(self, request):
+        if request.message_type == Message.CLIENT_BATCH_SUBMIT_REQUEST:
+            return Message.CLIENT_BATCH_SUBMIT_RESPONSE, self._submit(
+                ClientBatchSubmitRequest.FromString(request.content))
+        if request.message_type == Message.CLIENT_BATCH_STATUS_REQUEST:
+            return Message.CLIENT_BATCH_STATUS_RESPONSE, self._batch_statuses(
+                ClientBatchStatusRequest.FromString(request.content))
+        if request.message_type == Message.CLIENT_STATE_LIST_REQUEST:
+            return Message.CLIENT_STATE_LIST_RESPONSE, self._list_state(
+                ClientStateListRequest.FromString(request.content))
+        if request.message_type == Message.CLIENT_BLOCK_LIST_REQUEST:
+            return Message.CLIENT_BLOCK_LIST_RESPONSE, self._list_blocks()
+
+        LOGGER.warning('Unsupported request: %s',
+                       Message.MessageType.Name(request.message_type))
+        return Message.DEFAULT, ClientBatchSubmitResponse()
+
+    def _submit(self, request):
+        for batch in request.batches:
+            changes = {}
+            try:
+                for transaction in batch.transactions:
+                    self._apply(transaction, changes)
+            except (InvalidTransaction, InternalError) as err:
+                LOGGER.info('Invalid batch %s: %s', batch.header_signature[:8], err)
+                self._statuses[batch.header_signature] = ClientBatchStatus(
+                    batch_id=batch.header_signature,
+                    status=ClientBatchStatus.INVALID,
+                    invalid_transactions=[ClientBatchStatus.InvalidTransaction(
+                        transaction_id=transaction.header_signature,
+                        message=str(err))])
+                continue
+
+            self._state.update(changes)
+            self._head = hashlib.sha512(
+                (self._head + batch.header_signature).encode()).hexdigest()
+            self._statuses[batch.header_signature] = ClientBatchStatus(
+                batch_id=batch.header_signature,
+                status=ClientBatchStatus.COMMITTED)
+
+        return ClientBatchSubmitResponse(status=ClientBatchSubmitResponse.OK)
+
+    def _apply(self, transaction, changes):
+        header = TransactionHeader.FromString(transaction.header)
+        handler = self._handlers.get((header.family_name, header.family_version))
+        if handler is None:
+            raise InvalidTransaction('Unknown family: {} {}'.format(
+                header.family_name, header.family_version))
+
+        handler.apply(
+            TpProcessRequest(
+                header=header,
+                payload=transaction.payload,
+                signature=transaction.header_signature),
+            _Context(self._state, changes, header))
+
+    def _batch_statuses(self, request):
+        return ClientBatchStatusResponse(
+            status=ClientBatchStatusResponse.OK,
+            batch_statuses=[
+                self._statuses.get(batch_id, ClientBatchStatus(
+                    batch_id=batch_id, status=ClientBatchStatus.UNKNOWN))
+                for batch_id in request.batch_ids
+            ])
+
+    def _list_state(self, request):
+        addresses = sorted(
+            address for address in self._state if address.startswith(request.address))
+        if request.paging.start:
+            addresses = [a for a in addresses if a >= request.paging.start]
+        limit = request.paging.limit or 100
+        page, rest = addresses[:limit], addresses[limit:]
+
+        response = ClientStateListResponse(
+            status=ClientStateListResponse.OK if page else ClientStateListResponse.NO_RESOURCE,
+            entries=[
+                ClientStateListResponse.Entry(address=a, data=self._state[a]) for a in page],
+            paging=ClientPagingResponse(next=rest[0] if rest else '', limit=limit))
+        setattr(response, _ROOT_FIELD, self._head)
+        return response
+
+    def _list_blocks(self):
+        # the head block id doubles as its state root
+        return ClientBlockListResponse(
+            status=ClientBlockListResponse.OK,
+            head_id=self._head,
+            blocks=[Block(
+                header=BlockHeader(state_root_hash=self._head).SerializeToString(),
+                header_signature=self._head)])
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-B', '--bind',
+        default=LOCAL_DEFAULT_URL,
+        help='Endpoint the client requests are served on')
+
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='Increase output sent to stderr')
+
+    return parser.parse_args(args)
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+    init_console_logging(verbose_level=opts.verbose)
+
+    validator = LocalValidator(opts.bind)
+    try:
+        validator.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        validator.close()
@@ -14,9 +14,24 @@
 # -----------------------------------------------------------------------------
 
 __all__ = [
+    'capbac_async_client',
+    'capbac_batch',
+    'capbac_bench',
+    'capbac_builder',
+    'capbac_cache',
     'capbac_cli',
     'capbac_client',
+    'capbac_daemon',
     'capbac_exceptions',
+    'capbac_offline',
+    'capbac_pipeline',
+    'capbac_rate',
+    'capbac_remote',
+    'capbac_rules',
+    'capbac_signer',
+    'capbac_submitter',
+    'capbac_transport',
+    'capbac_validator_transport',
     'capbac_version'
 ]
 
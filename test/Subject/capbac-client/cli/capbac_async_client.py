@@ -0,0 +1,202 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import asyncio
+import json
+
+import aiohttp
+
+from cli.capbac_client import CapBACLocalClient
+from cli.capbac_client import DEFAULT_TIMEOUT
+from cli.capbac_client import _check_format
+from cli.capbac_client import _decode_entries
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_transport import _next_page
+from cli.capbac_transport import _state_query
+from cli.capbac_version import *
+
+DEFAULT_POOL_SIZE = 100 # keep-alive connections to the REST API
+DEFAULT_CONCURRENCY = 1000 # requests in flight at once
+
+class AsyncCapBACClient:
+    """asyncio counterpart of CapBACClient.
+
+    Token checks, signing and transaction building come from
+    CapBACLocalClient (they do not block on I/O); only the requests to the REST
+    API are asynchronous (tcp:// validator endpoints are not supported). At
+    most `concurrency` requests are in flight, over at most `pool_size`
+    keep-alive connections. Cancelling the calling task cancels the pending
+    request.
+    """
+
+    def __init__(self, url, keyfile=None, pool_size=DEFAULT_POOL_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        if url.startswith('tcp://') or ',' in url:
+            raise CapBACClientException('Invalid URL: one REST API expected')
+        self._client = CapBACLocalClient(keyfile)
+        self.url = url
+        self.timeout = timeout
+        self._pool_size = pool_size
+        self._concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+        self.in_flight = 0 # requests sent and not yet answered
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def issue(self, token, is_root):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid token: serialization failed')
+
+        return await self.issue_from_dict(token, is_root)
+
+    async def issue_from_dict(self, token, is_root):
+
+        transaction = self._client._create_issue_transaction(token, is_root)
+
+        return await self._send_transactions([transaction])
+
+    async def revoke(self, token):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid revocation token: serialization failed')
+
+        return await self.revoke_from_dict(token)
+
+    async def revoke_from_dict(self, token):
+
+        transaction = self._client._create_revoke_transaction(token)
+
+        return await self._send_transactions([transaction])
+
+    async def list(self, device):
+
+        if len(device) > MAX_URI_LENGTH:
+            raise CapBACClientException(
+                'Invalid URI: max length exceeded, should be less than {}'
+                .format(MAX_URI_LENGTH))
+
+        try:
+            state = await self._get_state(device)
+        except CapBACClientException:
+            raise
+        except BaseException:
+            return None
+
+        return json.dumps(state, indent=4, sort_keys=True)
+
+    async def validate(self, token):
+
+        try:
+            token = json.loads(token)
+        except:
+            raise CapBACClientException('Invalid access token: serialization failed')
+
+        return await self.validate_from_dict(token)
+
+    async def validate_from_dict(self, token):
+
+        _check_format(token,"access token",VALIDATION_FORMAT)
+
+        # state retrival
+        try:
+            state = await self._get_state(token['DE'])
+        except CapBACClientException:
+            raise
+        except BaseException:
+            return None
+
+        return self._client._check_access(token, state)
+
+    async def _get_state(self, device):
+        state = {}
+        query = _state_query(self._client._get_address(device))
+        while query is not None:
+            page = json.loads(await self._send_request(query))
+            state.update(_decode_entries(page["data"]))
+            query = _next_page(page)
+        return state
+
+    def sign(self, token):
+        return self._client.sign(token)
+
+    def sign_dict(self, token):
+        return self._client.sign_dict(token)
+
+    async def _send_transactions(self, transactions):
+
+        batch_list = self._client._create_batch_list(transactions)
+
+        return await self._send_request(
+            "batches", batch_list.SerializeToString(),
+            'application/octet-stream'
+        )
+
+    async def _send_request(self,
+                            suffix,
+                            data=None,
+                            contentType=None):
+        if self.url.startswith(("http://", "https://")):
+            url = "{}/{}".format(self.url, suffix)
+        else:
+            url = "http://{}/{}".format(self.url, suffix)
+
+        headers = {}
+
+        if contentType is not None:
+            headers['Content-Type'] = contentType
+
+        # created on first use, from within the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size))
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        try:
+            async with self._semaphore:
+                self.in_flight += 1
+                try:
+                    return await asyncio.wait_for(
+                        self._fetch(url, headers, data), self.timeout)
+                finally:
+                    self.in_flight -= 1
+
+        except aiohttp.ClientConnectionError as err:
+            raise CapBACClientException(
+                'Failed to connect to {}: {}'.format(url, str(err)))
+
+        except asyncio.TimeoutError:
+            raise CapBACClientException(
+                'Request to {} timed out'.format(url))
+
+    async def _fetch(self, url, headers, data):
+        if data is not None:
+            request = self._session.post(url, headers=headers, data=data)
+        else:
+            request = self._session.get(url, headers=headers)
+
+        async with request as result:
+            if result.status >= 400:
+                raise CapBACClientException("Error {}: {}".format(
+                    result.status, result.reason))
+            return await result.text()
@@ -0,0 +1,102 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import json
+
+from collections import deque
+from concurrent.futures import Future
+
+from cli.capbac_exceptions import CapBACClientException
+
+DEFAULT_PENDING = 10000 # commands read ahead of the first unanswered one
+
+def run_batch(client, commands, output, max_pending=DEFAULT_PENDING, **kwargs):
+    """Runs a JSONL stream of commands, writing one JSONL result per command.
+
+    Each command is {"command": "issue" (with "root"), "revoke", "sign" or
+    "validate", "token": token}. Issues and revocations are posted together
+    by a BatchSubmitter (`kwargs` are its options), each in a batch of its
+    own, and answered with their batch status, INVALID ones as errors; signatures and
+    validations are answered at once. Results are {"line", "output"} or
+    {"line", "error"}, written in input order as soon as the first pending
+    command completes. Returns the number of failed commands.
+    """
+    submitter = client.submitter(**kwargs)
+    pending = deque()
+    failed = 0
+    try:
+        for number, line in enumerate(commands, 1):
+            if not line.strip():
+                continue
+            pending.append((number, _run_command(client, submitter, line)))
+
+            # write the completed head, wait for it when too far ahead
+            while pending and (len(pending) >= max_pending or _is_done(pending[0][1])):
+                failed += _write_result(output, *pending.popleft())
+    finally:
+        submitter.close()
+
+    while pending:
+        failed += _write_result(output, *pending.popleft())
+
+    return failed
+
+def _run_command(client, submitter, line):
+    # a Future for submissions, the output or the exception otherwise
+    try:
+        command = json.loads(line)
+        token = command['token']
+        if isinstance(token, str):
+            token = json.loads(token)
+
+        action = command['command']
+        if action == 'issue':
+            return submitter.issue_from_dict(token, command.get('root', False))
+        if action == 'revoke':
+            return submitter.revoke_from_dict(token)
+        if action == 'sign':
+            return client.sign_dict(token)
+        if action == 'validate':
+            return {'authorized': client.validate_from_dict(token)}
+
+        raise CapBACClientException('Invalid command: {}'.format(action))
+
+    except (CapBACClientException, KeyError, TypeError, ValueError) as err:
+        return err
+
+def _is_done(result):
+    return not isinstance(result, Future) or result.done()
+
+def _write_result(output, number, result):
+    if isinstance(result, Future):
+        try:
+            result = result.result()
+        except BaseException as err:
+            result = err
+
+    if isinstance(result, dict) and result.get('status') == 'INVALID':
+        # the command's own batch: only this command failed
+        result = CapBACClientException('Batch {} INVALID{}'.format(
+            result['batch_id'],
+            ': ' + result['message'] if 'message' in result else ''))
+
+    if isinstance(result, BaseException):
+        output.write(json.dumps({'line': number, 'error': str(result)}) + '\n')
+        output.flush()
+        return 1
+
+    output.write(json.dumps({'line': number, 'output': result}) + '\n')
+    output.flush()
+    return 0
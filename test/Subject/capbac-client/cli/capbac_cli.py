@@ -15,6 +15,7 @@
 
 import argparse
 import getpass
+import json
 import logging
 import os
 import sys
@@ -23,12 +24,17 @@ import traceback
 from colorlog import ColoredFormatter
 
 from cli.capbac_client import CapBACClient
+from cli.capbac_client import get_batch_ids
 from cli.capbac_exceptions import CapBACCliException
 from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_remote import DEFAULT_SOCKET
 from cli.capbac_version import *
 
 DEFAULT_URL = 'http://rest-api:8008'
 
+# the modules of the other subcommands (processes, sockets, asyncio) are
+# imported by their handlers, so that the common ones start quickly
+
 def create_console_handler(verbose_level=2):
     clog = logging.StreamHandler()
     formatter = ColoredFormatter(
@@ -92,6 +98,12 @@ def create_parser(prog_name):
     add_revoke_parser(subparsers,parent_parser)
     add_validate_parser(subparsers,parent_parser)
     add_sign_parser(subparsers,parent_parser)
+    add_budget_parser(subparsers,parent_parser)
+    add_batch_parser(subparsers,parent_parser)
+    add_bench_parser(subparsers,parent_parser)
+    add_prepare_parser(subparsers,parent_parser)
+    add_upload_parser(subparsers,parent_parser)
+    add_serve_parser(subparsers,parent_parser)
 
     return parser
 
@@ -109,6 +121,11 @@ def add_issue_parser(subparsers, parent_parser):
         action='store_true',
         help='specify that the capability token to be issued is a root capability')
 
+    parser.add_argument(
+        '--precheck',
+        action='store_true',
+        help='check the delegation against the current state before sending')
+
     parser.add_argument(
         'token',
         type=str,
@@ -117,17 +134,19 @@ def add_issue_parser(subparsers, parent_parser):
     parser.add_argument(
         '--url',
         type=str,
-        help='specify URL of REST API')
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
 
     parser.add_argument(
         '--keyfile',
         type=str,
         help="identify file containing user's private key")
 
+    _add_wait_argument(parser)
+
 def do_issue(args):
     client = _get_client(args)
     response = client.issue(args.token,args.root)
-    print("{}".format(response))
+    _print_response(client, response, args.wait)
 
 def add_list_parser(subparsers, parent_parser):
     message = 'List all capability tokens issued for the specified device.'
@@ -143,13 +162,21 @@ def add_list_parser(subparsers, parent_parser):
         type=str,
         help='URI of the device')
 
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='write tokens as they are read, in bounded memory (unsorted)')
+
     parser.add_argument(
         '--url',
         type=str,
-        help='specify URL of REST API')
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
 
 def do_list(args):
     client = _get_client(args)
+    if args.stream:
+        client.stream_list(args.device, sys.stdout)
+        return
     token_list = client.list(args.device)
     print(token_list)
 
@@ -171,17 +198,43 @@ def add_revoke_parser(subparsers, parent_parser):
     parser.add_argument(
         '--url',
         type=str,
-        help='specify URL of REST API')
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
 
     parser.add_argument(
         '--keyfile',
         type=str,
         help="identify file containing user's private key")
 
+    _add_wait_argument(parser)
+
 def do_revoke(args):
     client = _get_client(args)
     response = client.revoke(args.token)
-    print("{}".format(response))
+    _print_response(client, response, args.wait)
+
+def _add_wait_argument(parser):
+    parser.add_argument(
+        '--wait',
+        type=int,
+        nargs='?',
+        const=DEFAULT_WAIT,
+        help='wait up to WAIT seconds (default {}) for the batch to be committed'
+        .format(DEFAULT_WAIT))
+
+def _print_response(client, response, wait):
+    if wait is None:
+        print("{}".format(response))
+        return
+
+    statuses = client.wait_for_commit(get_batch_ids(response), wait)
+    output = json.loads(response)
+    output['statuses'] = statuses
+    print(json.dumps(output, indent=4, sort_keys=True))
+
+    for batch_id, status in statuses.items():
+        if status['status'] != 'COMMITTED':
+            raise CapBACCliException(
+                "Batch {} {}".format(batch_id, status['status']))
 
 def add_validate_parser(subparsers, parent_parser):
     message = 'Check the validity of the access token over the ledger state.'
@@ -200,7 +253,7 @@ def add_validate_parser(subparsers, parent_parser):
     parser.add_argument(
         '--url',
         type=str,
-        help='specify URL of REST API')
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
 
     parser.add_argument(
         '--keyfile',
@@ -237,10 +290,364 @@ def do_sign(args):
     response = client.sign(args.token)
     print(response)
 
+def add_budget_parser(subparsers, parent_parser):
+    message = 'Report the state size of each device against the on-chain budget.'
+
+    parser = subparsers.add_parser(
+        'budget',
+        parents=[parent_parser],
+        description=message,
+        help='show state size and limits for devices')
+
+    parser.add_argument(
+        'devices',
+        type=str,
+        nargs='+',
+        help='URIs of the devices')
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
+
+def do_budget(args):
+    client = _get_client(args)
+    report = client.budget(args.devices)
+    print(report)
+
+def add_batch_parser(subparsers, parent_parser):
+    message = 'Runs a JSONL stream of commands ({"command": "issue", "token": {...}}, \
+         or revoke, sign, validate) and writes one JSONL result per command.'
+
+    parser = subparsers.add_parser(
+        'batch',
+        parents=[parent_parser],
+        description=message,
+        help='run many commands in one process')
+
+    parser.add_argument(
+        'file',
+        type=str,
+        nargs='?',
+        default='-',
+        help='JSONL file of commands (default stdin)')
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
+
+    parser.add_argument(
+        '--keyfile',
+        type=str,
+        help="identify file containing user's private key")
+
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='pace submissions to the validator backpressure')
+
+    parser.add_argument(
+        '--target-latency',
+        type=float,
+        help='with --adaptive, also slow down when batches take longer than \
+             TARGET_LATENCY seconds to be committed')
+
+def do_batch(args):
+    from cli.capbac_batch import run_batch
+
+    client = _get_client(args)
+    if args.file == '-':
+        failed = run_batch(client, sys.stdin, sys.stdout)
+    else:
+        try:
+            with open(args.file) as fd:
+                failed = run_batch(client, fd, sys.stdout)
+        except OSError as err:
+            raise CapBACCliException('Failed to read commands: {}'.format(err))
+    if failed:
+        raise CapBACCliException('{} commands failed'.format(failed))
+
+def add_bench_parser(subparsers, parent_parser):
+    message = 'Generates keys and a delegation tree on a new device, then drives \
+         a mix of operations and reports throughput and latency percentiles as JSON.'
+
+    parser = subparsers.add_parser(
+        'bench',
+        parents=[parent_parser],
+        description=message,
+        help='measure what a deployment sustains')
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
+
+    parser.add_argument(
+        '--duration',
+        type=float,
+        help='seconds of load (default 10)')
+
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='operations per second overall (default as fast as possible)')
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='worker processes (default one per core)')
+
+    parser.add_argument(
+        '--mix',
+        type=str,
+        help='weights of issue, revoke, validate and sign as name=weight pairs \
+             (default issue=1,revoke=1,validate=8,sign=0)')
+
+    parser.add_argument(
+        '--build',
+        type=int,
+        nargs='?',
+        const=0,
+        help='only time the local building of BUILD transactions (default 10000)')
+
+    parser.add_argument(
+        '--concurrent',
+        type=int,
+        nargs='?',
+        const=0,
+        help='only start CONCURRENT validations at once through the asyncio \
+             client (default 10000, REST API only)')
+
+    parser.add_argument(
+        '--remote',
+        type=int,
+        nargs='?',
+        const=0,
+        help='only time REMOTE signatures by new capbac processes, by new \
+             capbac-remote processes through a daemon, and over one daemon \
+             connection (default 20)')
+
+def do_bench(args):
+    from cli import capbac_bench
+
+    # a flag given without a value (0) runs its default size
+    if args.build is not None:
+        report = capbac_bench.run_build_bench(
+            args.build or capbac_bench.DEFAULT_BUILD_COUNT)
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return
+
+    if args.remote is not None:
+        report = capbac_bench.run_remote_bench(
+            DEFAULT_URL if args.url is None else args.url,
+            args.remote or capbac_bench.DEFAULT_REMOTE_COUNT)
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return
+
+    if args.concurrent is not None:
+        report = capbac_bench.run_async_bench(
+            DEFAULT_URL if args.url is None else args.url,
+            args.concurrent or capbac_bench.DEFAULT_CONCURRENT)
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return
+
+    mix = None
+    if args.mix is not None:
+        mix = {}
+        try:
+            for item in args.mix.split(','):
+                name, weight = item.split('=')
+                if name not in capbac_bench.OPERATIONS:
+                    raise ValueError(name)
+                mix[name] = float(weight)
+        except ValueError:
+            raise CapBACCliException(
+                'Invalid mix: expected name=weight pairs of {}'.format(
+                    ', '.join(capbac_bench.OPERATIONS)))
+
+    report = capbac_bench.run_bench(
+        DEFAULT_URL if args.url is None else args.url,
+        workers=args.workers,
+        duration=capbac_bench.DEFAULT_DURATION if args.duration is None
+        else args.duration,
+        rate=args.rate,
+        mix=mix)
+    print(json.dumps(report, indent=4, sort_keys=True))
+
+def add_prepare_parser(subparsers, parent_parser):
+    message = 'Signs a JSONL stream of operations ({"AC": "issue" or "revoke", \
+         "OB": token}, or bare tokens to issue) into a file of batches, \
+         without connecting to the ledger.'
+
+    parser = subparsers.add_parser(
+        'prepare',
+        parents=[parent_parser],
+        description=message,
+        help='sign batches offline for a later upload')
+
+    parser.add_argument(
+        'file',
+        type=str,
+        nargs='?',
+        default='-',
+        help='JSONL file of operations (default stdin)')
+
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        required=True,
+        help='file of signed batches to write')
+
+    parser.add_argument(
+        '--keyfile',
+        type=str,
+        help="identify file containing user's private key")
+
+    parser.add_argument(
+        '--processes',
+        type=int,
+        help='signing processes (default one per core)')
+
+def do_prepare(args):
+    from cli.capbac_offline import prepare
+    from cli.capbac_pipeline import read_operations
+
+    keyfile = _get_keyfile(args)
+    if args.file == '-':
+        result = prepare(keyfile, read_operations(sys.stdin), args.output, args.processes)
+    else:
+        try:
+            with open(args.file) as fd:
+                result = prepare(keyfile, read_operations(fd), args.output, args.processes)
+        except OSError as err:
+            raise CapBACCliException('Failed to read operations: {}'.format(err))
+    print(json.dumps(result, indent=4, sort_keys=True))
+
+def add_upload_parser(subparsers, parent_parser):
+    message = 'Submits a file of batches written by `capbac prepare`, in order.'
+
+    parser = subparsers.add_parser(
+        'upload',
+        parents=[parent_parser],
+        description=message,
+        help='submit batches signed offline')
+
+    parser.add_argument(
+        'file',
+        type=str,
+        help='file of signed batches')
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip the batches accepted by a previous upload of the file')
+
+    parser.add_argument(
+        '--max-batches',
+        type=int,
+        help='batches per post (default 100)')
+
+    parser.add_argument(
+        '--max-bytes',
+        type=int,
+        help='bytes per post (default 1048576)')
+
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='pace submissions to the validator backpressure')
+
+    parser.add_argument(
+        '--target-latency',
+        type=float,
+        help='with --adaptive, also slow down when batches take longer than \
+             TARGET_LATENCY seconds to be committed')
+
+    parser.add_argument(
+        '--wait',
+        type=int,
+        nargs='?',
+        const=DEFAULT_WAIT,
+        help='wait for the batches to be committed (default {} seconds)'.format(
+            DEFAULT_WAIT))
+
+def do_upload(args):
+    from cli import capbac_offline
+
+    client = _get_client(args)
+    result = capbac_offline.upload(
+        client, args.file, args.resume,
+        capbac_offline.DEFAULT_POST_BATCHES if args.max_batches is None
+        else args.max_batches,
+        capbac_offline.DEFAULT_POST_BYTES if args.max_bytes is None
+        else args.max_bytes)
+    batch_ids = result.pop('batch_ids')
+
+    if args.wait is not None:
+        counts = {}
+        for status in client.wait_for_commit(batch_ids, args.wait).values():
+            counts[status['status']] = counts.get(status['status'], 0) + 1
+        result['statuses'] = counts
+
+    print(json.dumps(result, indent=4, sort_keys=True))
+    if args.wait is not None and set(result['statuses']) != {'COMMITTED'} \
+            and batch_ids:
+        raise CapBACCliException('Not all batches were committed')
+
+def add_serve_parser(subparsers, parent_parser):
+    message = 'Serves validate, sign, issue, revoke and list to capbac-remote \
+         from one process, keeping sessions, caches and keys loaded.'
+
+    parser = subparsers.add_parser(
+        'serve',
+        parents=[parent_parser],
+        description=message,
+        help='run the capbac daemon on a Unix socket')
+
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=DEFAULT_SOCKET,
+        help='Unix socket to listen on (default {})'.format(DEFAULT_SOCKET))
+
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='specify URL of REST API or tcp:// validator endpoint (comma separated to balance)')
+
+    parser.add_argument(
+        '--keyfile',
+        type=str,
+        help="identify file containing user's private key")
+
+def do_serve(args):
+    from cli.capbac_daemon import CapBACDaemon
+
+    daemon = CapBACDaemon(
+        args.socket,
+        DEFAULT_URL if args.url is None else args.url,
+        _get_keyfile(args))
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
+
 def _get_client(args):
+    if getattr(args, 'target_latency', None) is not None \
+            and not getattr(args, 'adaptive', False):
+        raise CapBACCliException('--target-latency requires --adaptive')
     return CapBACClient(
         url=DEFAULT_URL if args.url is None else args.url,
-        keyfile=_get_keyfile(args))
+        keyfile=_get_keyfile(args),
+        precheck=getattr(args, 'precheck', False),
+        adaptive=getattr(args, 'adaptive', False),
+        target_latency=getattr(args, 'target_latency', None))
 
 def _get_keyfile(args):
     try:
@@ -277,6 +684,12 @@ def main(prog_name=os.path.basename(sys.argv[0]), args=None):
     elif args.command == 'validate': do_validate(args)
     elif args.command == 'list':     do_list(args)
     elif args.command == 'sign':     do_sign(args)
+    elif args.command == 'budget':   do_budget(args)
+    elif args.command == 'batch':    do_batch(args)
+    elif args.command == 'bench':    do_bench(args)
+    elif args.command == 'prepare':  do_prepare(args)
+    elif args.command == 'upload':   do_upload(args)
+    elif args.command == 'serve':    do_serve(args)
     else:
         raise CapBACCliException("Invalid command: {}".format(args.command))
 
@@ -0,0 +1,164 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+# Batches signed offline are stored as a header (MAGIC) followed by one
+# record per batch: its length as 4 bytes big endian, then the serialized
+# Batch. Uploads record the offset of the first batch not yet accepted in
+# a side file (<file>.offset), from which an interrupted upload resumes.
+
+import logging
+import os
+import struct
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+
+from cli.capbac_client import MAX_BATCH_BYTES
+from cli.capbac_client import MAX_BATCH_TRANSACTIONS
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_pipeline import sign_batches
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'CAPBAC\x00\x01'
+DEFAULT_POST_BATCHES = 100 # batches per BatchList posted
+DEFAULT_POST_BYTES = MAX_BATCH_BYTES # bytes per BatchList posted
+
+_LENGTH = struct.Struct('>I')
+
+def prepare(keyfile, operations, path, processes=None,
+            batch_size=MAX_BATCH_TRANSACTIONS):
+    """Signs the operations into batches written to the file at `path`.
+
+    Operations are those of capbac_pipeline.read_operations, signed by a
+    pool of `processes` workers. The file only appears once complete.
+    Returns {"batches", "transactions", "bytes"}.
+    """
+    temporary = path + '.tmp'
+    result = {'batches': 0, 'transactions': 0}
+
+    def counted(operations):
+        for operation in operations:
+            result['transactions'] += 1
+            yield operation
+
+    try:
+        with open(temporary, 'wb') as fd:
+            fd.write(MAGIC)
+            for batch in sign_batches(keyfile, counted(operations), processes, batch_size):
+                fd.write(_LENGTH.pack(len(batch)))
+                fd.write(batch)
+                result['batches'] += 1
+            result['bytes'] = fd.tell()
+        os.replace(temporary, path)
+    except OSError as err:
+        raise CapBACClientException('Failed to write {}: {}'.format(path, err))
+    finally:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+
+    return result
+
+def read_batches(fd, offset=None):
+    """Yields (offset after the record, serialized Batch) from `offset`."""
+    if fd.read(len(MAGIC)) != MAGIC:
+        raise CapBACClientException('Invalid batch file: wrong header')
+    position = len(MAGIC)
+    if offset is not None and offset > position:
+        fd.seek(offset)
+        position = offset
+
+    while True:
+        prefix = fd.read(_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) < _LENGTH.size:
+            raise CapBACClientException('Invalid batch file: truncated at {}'.format(position))
+        length, = _LENGTH.unpack(prefix)
+        data = fd.read(length)
+        if len(data) < length:
+            raise CapBACClientException('Invalid batch file: truncated at {}'.format(position))
+        position += _LENGTH.size + length
+        yield position, data
+
+def upload(client, path, resume=False, max_batches=DEFAULT_POST_BATCHES,
+           max_bytes=DEFAULT_POST_BYTES):
+    """Submits the batches of the file, in order, in BatchLists of at most
+    `max_batches` batches and `max_bytes` bytes.
+
+    Posts are sent one at a time so that the validator receives the
+    batches in file order (a delegation after its parent). The offset of
+    the next batch is saved after each accepted post; with `resume`, the
+    upload starts from the saved offset. A batch larger than `max_bytes`
+    stops the upload there. Returns {"batches", "posts", "bytes",
+    "seconds", "batch_ids"}.
+    """
+    progress = path + '.offset'
+    offset = _read_offset(progress) if resume else None
+
+    result = {'batches': 0, 'posts': 0, 'bytes': 0, 'batch_ids': []}
+    start = time.time()
+    try:
+        with open(path, 'rb') as fd:
+            pending = []
+            size = 0
+            end = offset
+            for end_offset, data in read_batches(fd, offset):
+                if len(data) > max_bytes:
+                    raise CapBACClientException(
+                        'Batch at offset {} is {} bytes, over the {} bytes of a post'
+                        .format(end_offset - _LENGTH.size - len(data), len(data), max_bytes))
+                if pending and (len(pending) >= max_batches
+                                or size + len(data) > max_bytes):
+                    _post(client, pending, end, progress, result)
+                    pending = []
+                    size = 0
+                pending.append(data)
+                size += len(data)
+                end = end_offset
+            if pending:
+                _post(client, pending, end, progress, result)
+    except OSError as err:
+        raise CapBACClientException('Failed to read {}: {}'.format(path, err))
+
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+def _post(client, pending, end, progress, result):
+    batches = [Batch.FromString(data) for data in pending]
+    client._submit(batches)
+    _write_offset(progress, end)
+
+    result['posts'] += 1
+    result['batches'] += len(batches)
+    result['bytes'] += sum(len(data) for data in pending)
+    result['batch_ids'].extend(batch.header_signature for batch in batches)
+    LOGGER.info('Uploaded %d batches (offset %d)', result['batches'], end)
+
+def _read_offset(progress):
+    try:
+        with open(progress) as fd:
+            return int(fd.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        raise CapBACClientException('Failed to read {}: {}'.format(progress, err))
+
+def _write_offset(progress, offset):
+    # replaced at once, never left half written
+    temporary = progress + '.tmp'
+    with open(temporary, 'w') as fd:
+        fd.write(str(offset))
+    os.replace(temporary, progress)
@@ -0,0 +1,118 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+# Thin client of `capbac serve`: only the standard library (and the
+# constants of capbac_version) is imported, so that each invocation starts
+# in a fraction of the time of the full CLI.
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+from cli.capbac_version import DEFAULT_WAIT
+
+DEFAULT_SOCKET = os.environ.get(
+    'CAPBAC_SOCKET',
+    os.path.join(os.path.expanduser('~'), '.sawtooth', 'capbac.sock'))
+
+class RemoteException(Exception):
+    pass
+
+class RemoteClient:
+    """Forwards commands to the daemon over one persistent connection."""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(path)
+        except OSError as err:
+            raise RemoteException(
+                'Failed to connect to the capbac daemon on {}: {}'.format(path, err))
+        self._file = self._socket.makefile('rwb')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def call(self, **request):
+        """Returns the daemon's response: {"output": ...} and maybe "error"."""
+        self._file.write((json.dumps(request) + '\n').encode('utf-8'))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise RemoteException('Connection closed by the capbac daemon')
+        return json.loads(line.decode('utf-8'))
+
+def create_parser(prog_name):
+    parser = argparse.ArgumentParser(
+        prog=prog_name,
+        description='Forwards capbac commands to a running `capbac serve`')
+
+    parser.add_argument(
+        '--socket',
+        default=DEFAULT_SOCKET,
+        help='Unix socket of the daemon (default {})'.format(DEFAULT_SOCKET))
+
+    subparsers = parser.add_subparsers(title='subcommands', dest='command')
+    subparsers.required = True
+
+    for command, argument in [('issue', 'token'), ('revoke', 'token'),
+                              ('validate', 'token'), ('sign', 'token'),
+                              ('list', 'device')]:
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument(argument, type=str)
+        if command != 'sign':
+            subparser.add_argument('--url', type=str)
+        if command != 'list':
+            subparser.add_argument('--keyfile', type=str)
+        if command in ('issue', 'revoke'):
+            subparser.add_argument('--wait', type=int, nargs='?', const=DEFAULT_WAIT)
+        if command == 'issue':
+            subparser.add_argument('-r', '--root', action='store_true')
+            subparser.add_argument('--precheck', action='store_true')
+
+    return parser
+
+def main(prog_name=os.path.basename(sys.argv[0]), args=None):
+    if args is None:
+        args = sys.argv[1:]
+    args = vars(create_parser(prog_name).parse_args(args))
+
+    # the daemon runs in another working directory
+    if args.get('keyfile') is not None:
+        args['keyfile'] = os.path.abspath(args['keyfile'])
+
+    client = RemoteClient(args.pop('socket'))
+    try:
+        result = client.call(**{
+            name: value for name, value in args.items() if value is not None})
+    finally:
+        client.close()
+
+    if 'output' in result:
+        print(result['output'])
+    if 'error' in result:
+        raise RemoteException(result['error'])
+
+def main_wrapper():
+    try:
+        main()
+    except RemoteException as err:
+        print("Error: {}".format(err), file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,272 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+# Delegation rules shared by the processor and the client (copied into both
+# by update.sh, like capbac_version.py): the processor enforces them, the
+# client can run them before submitting.
+
+import hashlib
+import logging
+
+import cbor
+
+from google.protobuf.message import DecodeError
+from sawtooth_sdk.protobuf.setting_pb2 import Setting
+
+# relative: the package is `cli` in the client and `processor` in the processor
+from .capbac_version import BUDGET_SETTINGS
+from .capbac_version import SETTINGS_NAMESPACE
+
+LOGGER = logging.getLogger(__name__)
+
+class DelegationError(Exception):
+    pass
+
+def get_setting_address(key):
+    """Address of an on-chain setting (same scheme as the sawtooth_settings
+    family: four 16 chars key parts).
+    """
+    parts = key.split('.', maxsplit=3)
+    parts.extend([''] * (4 - len(parts)))
+    return SETTINGS_NAMESPACE + ''.join(
+        hashlib.sha256(part.encode('utf-8')).hexdigest()[:16] for part in parts)
+
+# read by issues (inputs declared by the client, fetched by the processor)
+BUDGET_ADDRESSES = {
+    name: get_setting_address(key) for name, key in BUDGET_SETTINGS.items()
+}
+
+def parse_budget_setting(key, data):
+    """Limit set by the setting `key` in its serialized state entry.
+
+    None (no limit) when the entry doesn't hold the key or its value is not
+    a non-negative number. Raises ValueError if the entry is not a Setting.
+    """
+    setting = Setting()
+    try:
+        setting.ParseFromString(data)
+    except DecodeError:
+        raise ValueError('Failed to load setting {}'.format(key))
+    for entry in setting.entries:
+        if entry.key == key:
+            try:
+                value = int(entry.value)
+            except ValueError:
+                LOGGER.warning('Ignoring setting %s: not a number', key)
+                return None
+            return value if value >= 0 else None
+    return None
+
+class DeviceState:
+    """Decoded state entry of a device.
+
+    The indexes derived from the tokens (children, delegation depth, chain
+    validity window and effective access rights) are built lazily and kept
+    as long as the entry is unchanged. Any modification of `tokens` other
+    than `add` must be followed by a new DeviceState for the encoded result.
+    """
+
+    def __init__(self, data, tokens=None, size=None):
+        self.data = data
+        if tokens is None:
+            tokens = cbor.loads(data) if data else {}
+        self.tokens = tokens
+        self._size = len(data) if size is None else size
+        self._children = None
+        self._chain = {}
+
+    @property
+    def size(self):
+        return self._size
+
+    def add(self, identifier, token):
+        """Adds an issued token in place, keeping the indexes built.
+
+        The token is new, so no stored token descends from it and the
+        chains already indexed stay valid. `size` grows by the encoded
+        token, and `data` (no longer the encoded state) becomes None.
+        """
+        self.tokens[identifier] = token
+        if self._children is not None:
+            self._children.setdefault(token['IC'], set()).add(identifier)
+        self._size += _added_size(identifier, token)
+        self.data = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            children = {}
+            for identifier, token in self.tokens.items():
+                children.setdefault(token['IC'], set()).add(identifier)
+            self._children = children
+        return self._children
+
+    def descendants(self, identifier):
+        found = []
+        pending = [identifier]
+        while pending:
+            for child in self.children.get(pending.pop(), ()):
+                found.append(child)
+                pending.append(child)
+        return found
+
+    def depth(self, identifier):
+        """Number of ancestors of the token."""
+        return self._get_chain(identifier)[0]
+
+    def window(self, identifier):
+        """Validity window of the whole chain ending with the token.
+
+        Returns (not_before, not_before_id, not_after, not_after_id) where the
+        ids are the tokens of the chain setting each bound.
+        """
+        return self._get_chain(identifier)[1]
+
+    def rights(self, identifier):
+        """Access rights of the token granted by every ancestor.
+
+        Maps resource -> action -> delegation depth of the token; pairs whose
+        delegation depth is not strictly decreasing along the chain are left out.
+        """
+        return self._get_chain(identifier)[2]
+
+    def _get_chain(self, identifier):
+        # walk up to the first ancestor already indexed, then fill downwards
+        # (raises KeyError with the missing identifier if the chain is broken)
+        path = []
+        current = identifier
+        while current is not None and current not in self._chain:
+            if current not in self.tokens:
+                raise KeyError(current)
+            path.append(current)
+            current = self.tokens[current]['IC']
+
+        parent = self._chain.get(current)
+        for current in reversed(path):
+            token = self.tokens[current]
+            not_before = (int(token['NB']), current)
+            not_after = (int(token['NA']), current)
+            if parent is None:
+                depth = 0
+                rights = token['AR']
+            else:
+                depth = parent[0] + 1
+                window = parent[1]
+                if window[0] > not_before[0]:
+                    not_before = window[0:2]
+                if window[2] <= not_after[0]:
+                    not_after = window[2:4]
+                rights = {}
+                for resource, actions in token['AR'].items():
+                    granted = parent[2].get(resource, {})
+                    for action, delegation in actions.items():
+                        if action in granted and delegation < granted[action]:
+                            rights.setdefault(resource, {})[action] = delegation
+            parent = (depth, not_before + not_after, rights)
+            self._chain[current] = parent
+        return parent
+
+def _added_size(identifier, token):
+    # the entry grows at most by the encoded token plus the map header
+    return len(cbor.dumps({identifier: token}))
+
+def format_rights(access_rights):
+    """Stored form of the access rights: resource -> action -> DD."""
+    new_format = {}
+    for access_right in access_rights:
+        new_format.setdefault(access_right['RE'],{})
+        new_format[access_right['RE']].update({access_right['AC']:access_right['DD']})
+    return new_format
+
+def check_issue(identifier, token, parent, subject, entry, budget, now):
+    """Raises DelegationError if the token can't be added to the entry.
+
+    `token` is in its stored form (no ID and VR, formatted access rights),
+    `subject` is the public key of the issuer and `budget` the device limits
+    (None for no limit).
+    """
+    state = entry.tokens
+
+    if parent == None and state != {}:
+        raise DelegationError(
+            'Cannot issue: root token can only be issued once')
+
+    if identifier in state:
+        raise DelegationError(
+            'Cannot issue: capability token with ID = {} already exists'
+            .format(identifier))
+
+    # token count first, it needs no chain walk (depth and bytes come later)
+    if budget['max_tokens'] is not None and len(state) >= budget['max_tokens']:
+        raise DelegationError(
+            'Cannot issue: device already holds the maximum number of tokens ({})'
+            .format(budget['max_tokens']))
+
+    # check authorization
+    if parent != None:
+        if parent not in state:
+            raise DelegationError(
+                'Cannot issue: no parent capability token with ID = {}'.format(parent))
+        if state[parent]['SU'] != subject:
+            raise DelegationError('Cannot issue: issuer is not the subject of parent capability')
+
+    # delegation chain check (on the indexes of the stored chain)
+    if parent != None:
+        try:
+            depth = entry.depth(parent) + 1
+            not_before, inactive, not_after, expired = entry.window(parent)
+            rights = entry.rights(parent)
+        except KeyError as missing:
+            raise DelegationError(
+                'Cannot issue: no parent capability token with ID = {}'
+                .format(missing.args[0]))
+
+        if budget['max_depth'] is not None and depth > budget['max_depth']:
+            raise DelegationError(
+                'Cannot issue: maximum delegation depth ({}) exceeded'
+                .format(budget['max_depth']))
+
+        # check time interval
+        if now >= not_after:
+            raise DelegationError(
+                'Cannot issue: parent capability token with ID = {} expired'
+                .format(expired))
+        if now < not_before:
+            raise DelegationError(
+                'Cannot issue: capability token with ID = {} still not active'
+                .format(inactive))
+
+        # check access rights
+        for resource in token["AR"]:
+            if resource not in rights:
+                raise DelegationError(
+                    'Cannot issue: resource {} not authorized in parent token ID = {}'
+                    .format(resource, parent))
+            for action in token["AR"][resource]:
+                if action not in rights[resource]:
+                    raise DelegationError(
+                        'Cannot issue: action {} not authorized for resource {} in parent token ID = {}'
+                        .format(action,resource, parent))
+                if not token["AR"][resource][action] < rights[resource][action]:
+                    raise DelegationError(
+                        'Cannot issue: delegation should be less than parent for action {},\
+                         resource {}, parent token ID = {}'
+                        .format(action,resource, parent))
+
+    if budget['max_bytes'] is not None:
+        if entry.size + _added_size(identifier, token) > budget['max_bytes']:
+            raise DelegationError(
+                'Cannot issue: device state would exceed {} bytes'
+                .format(budget['max_bytes']))
@@ -0,0 +1,369 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------------
+
+import base64
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from cli.capbac_exceptions import CapBACBackpressureException
+from cli.capbac_exceptions import CapBACClientException
+from cli.capbac_exceptions import CapBACConnectionException
+from cli.capbac_exceptions import CapBACTimeoutException
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10 # keep-alive connections to the REST API
+DEFAULT_TIMEOUT = 30 # seconds
+DEFAULT_RETRIES = 3 # for idempotent requests only
+DEFAULT_PAGE_SIZE = 1000 # state entries per page (REST API maximum)
+HEALTH_INTERVAL = 5 # seconds between probes of an ejected endpoint
+SUBMITTED_SIZE = 100000 # batches whose endpoint is remembered for their statuses
+
+# REST API answers to a full validator queue (or a validator not ready)
+BACKPRESSURE_STATUSES = {429, 503}
+
+def create_transport(url, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                     retries=DEFAULT_RETRIES):
+    """REST API transport, or validator one for tcp:// endpoints.
+
+    A list of endpoints (or a comma separated string) is balanced by a
+    MultiTransport.
+    """
+    urls = split_urls(url)
+    if len(urls) > 1:
+        return MultiTransport([
+            create_transport(endpoint, pool_size, timeout, retries)
+            for endpoint in urls])
+    if urls and urls[0].startswith('tcp://'):
+        # zmq is only imported for validator endpoints
+        from cli.capbac_validator_transport import ValidatorTransport
+        return ValidatorTransport(urls[0], timeout)
+    return RestTransport(urls[0] if urls else None, pool_size, timeout, retries)
+
+def split_urls(url):
+    """Endpoints of a url: a list, or a comma separated string."""
+    if url is None:
+        return []
+    if isinstance(url, str):
+        url = url.split(',')
+    return [endpoint.strip() for endpoint in url if endpoint.strip()]
+
+class RestTransport:
+    """Requests to the sawtooth REST API over pooled keep-alive connections.
+
+    Every transport yields state pages as (head, [entry data]) and batch
+    statuses as {'id', 'status', 'invalid_transactions'}; submissions
+    return the REST API response (the batch statuses link).
+    """
+
+    def __init__(self, url, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES):
+        self.url = url
+        self.timeout = timeout
+
+        # one pooled keep-alive session reused by every request; failed
+        # connections and gateway errors are retried for GETs only
+        # (batch submissions are not idempotent). 502 and 504 are what the
+        # REST API answers while its validator connection is down, 503
+        # while the validator is not ready: transient states, retried after
+        # 0.1, 0.2 and 0.4 s before surfacing as errors (or backpressure)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.1,
+                status_forcelist=[502, 503, 504]))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def close(self):
+        self._session.close()
+
+    def submit(self, batches):
+        return self.request(
+            "batches", BatchList(batches=batches).SerializeToString(),
+            'application/octet-stream')
+
+    def iter_pages(self, address, limit):
+        query = _state_query(address, limit)
+        while query is not None:
+            page = json.loads(self.request(query))
+            yield page.get("head"), [
+                base64.b64decode(entry["data"]) for entry in page["data"]]
+            query = _next_page(page)
+
+    def get_head(self):
+        return json.loads(self.request("blocks?limit=1"))["head"]
+
+    def get_batch_statuses(self, batch_ids, wait):
+        result = self.request(
+            "batch_statuses?wait={}".format(wait),
+            json.dumps(batch_ids), 'application/json')
+        return [
+            {
+                'id': entry['id'],
+                'status': entry['status'],
+                'invalid_transactions': entry.get('invalid_transactions', [])
+            }
+            for entry in json.loads(result)['data']
+        ]
+
+    def request(self,
+                suffix,
+                data=None,
+                contentType=None):
+        if self.url.startswith(("http://", "https://")):
+            url = "{}/{}".format(self.url, suffix)
+        else:
+            url = "http://{}/{}".format(self.url, suffix)
+
+        headers = {}
+
+        if contentType is not None:
+            headers['Content-Type'] = contentType
+
+        try:
+            if data is not None:
+                result = self._session.post(
+                    url, headers=headers, data=data, timeout=self.timeout)
+            else:
+                result = self._session.get(
+                    url, headers=headers, timeout=self.timeout)
+
+        except requests.ConnectionError as err:
+            raise CapBACConnectionException(
+                'Failed to connect to {}: {}'.format(url, str(err)))
+
+        except requests.Timeout as err:
+            raise CapBACTimeoutException(
+                'Request to {} timed out: {}'.format(url, str(err)))
+
+        except requests.exceptions.RetryError as err:
+            # gateway errors still returned after the retries
+            status = _retried_status(err)
+            if status in BACKPRESSURE_STATUSES:
+                raise CapBACBackpressureException(
+                    'Error {}: {} (retries exhausted)'.format(status, url))
+            raise CapBACConnectionException(
+                'Failed to connect to {}: {}'.format(url, str(err)))
+
+        except requests.RequestException as err:
+            raise CapBACClientException(err)
+
+        if result.status_code in BACKPRESSURE_STATUSES:
+            raise CapBACBackpressureException("Error {}: {}".format(
+                result.status_code, result.reason))
+
+        if not result.ok:
+            raise CapBACClientException("Error {}: {}".format(
+                result.status_code, result.reason))
+
+        return result.text
+
+def _retried_status(err):
+    # urllib3 only reports the status in its message
+    match = re.search(r'too many (\d+) error responses', str(err))
+    return int(match.group(1)) if match else None
+
+def _state_query(address, limit=DEFAULT_PAGE_SIZE):
+    return "state?address={}&limit={}".format(address, limit)
+
+def _next_page(page):
+    # relative query of the next page, if any
+    link = page.get('paging', {}).get('next')
+    if not link:
+        return None
+    link = urlparse(link)
+    return '{}?{}'.format(link.path.lstrip('/'), link.query)
+
+class MultiTransport:
+    """Balances requests over several REST APIs or validator endpoints.
+
+    Reads go to the healthy endpoint with the fewest requests outstanding
+    (the pages of one listing stay on the first endpoint); batches are
+    pinned by the device of their first transaction, so that the updates
+    of a device reach the same validator in order, and their statuses are
+    asked to the endpoints that received them. An endpoint that can't be
+    reached is ejected and the request is retried on the next one (a
+    submission that timed out is not: it may have been accepted); a
+    background thread probes the ejected endpoints and readmits them once
+    they answer again.
+    """
+
+    def __init__(self, transports):
+        self.url = ','.join(transport.url for transport in transports)
+        self._endpoints = [_Endpoint(transport) for transport in transports]
+        self._submitted = OrderedDict() # batch id -> endpoint
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def close(self):
+        for endpoint in self._endpoints:
+            endpoint.transport.close()
+
+    def submit(self, batches):
+        header = TransactionHeader.FromString(batches[0].transactions[0].header)
+        key = header.outputs[0] if header.outputs else batches[0].header_signature
+        pinned = int(hashlib.sha512(key.encode('utf-8')).hexdigest()[:8], 16)
+
+        def send(endpoint):
+            response = endpoint.transport.submit(batches)
+            with self._lock:
+                for batch in batches:
+                    self._submitted[batch.header_signature] = endpoint
+                while len(self._submitted) > SUBMITTED_SIZE:
+                    self._submitted.popitem(last=False)
+            return response
+
+        return self._call(send, self._by_hash(pinned), retry_timeouts=False)
+
+    def iter_pages(self, address, limit):
+        # a listing can't move to another endpoint once started
+        pages = []
+        def first(endpoint):
+            iterator = endpoint.transport.iter_pages(address, limit)
+            pages.append((endpoint, iterator))
+            return next(iterator, None)
+
+        page = self._call(first, self._by_load())
+        if page is None:
+            return
+        yield page
+
+        endpoint, iterator = pages[-1]
+        while True:
+            with self._lock:
+                endpoint.outstanding += 1
+            try:
+                page = next(iterator, None)
+            finally:
+                with self._lock:
+                    endpoint.outstanding -= 1
+            if page is None:
+                return
+            yield page
+
+    def get_head(self):
+        return self._call(lambda endpoint: endpoint.transport.get_head(), self._by_load())
+
+    def get_batch_statuses(self, batch_ids, wait):
+        # grouped by the endpoint that received them (None if unknown)
+        groups = OrderedDict()
+        with self._lock:
+            for batch_id in batch_ids:
+                groups.setdefault(self._submitted.get(batch_id), []).append(batch_id)
+
+        def get(submitted, group):
+            order = self._by_load()
+            if submitted is not None and submitted.healthy:
+                order = [submitted] + [e for e in order if e is not submitted]
+            return self._call(
+                lambda endpoint: endpoint.transport.get_batch_statuses(group, wait), order)
+
+        if len(groups) <= 1:
+            return [status for submitted, group in groups.items()
+                    for status in get(submitted, group)]
+
+        # long-polled together, not one wait after the other
+        with ThreadPoolExecutor(len(groups)) as executor:
+            futures = [executor.submit(get, submitted, group)
+                       for submitted, group in groups.items()]
+            return [status for future in futures for status in future.result()]
+
+    def _by_load(self):
+        # healthy endpoints, fewest outstanding requests first (random ties)
+        with self._lock:
+            order = sorted(
+                self._endpoints,
+                key=lambda endpoint: (endpoint.outstanding, random.random()))
+        return self._healthy_first(order)
+
+    def _by_hash(self, value):
+        start = value % len(self._endpoints)
+        return self._healthy_first(self._endpoints[start:] + self._endpoints[:start])
+
+    def _healthy_first(self, order):
+        # the ejected endpoints are only tried when no other is left
+        return [e for e in order if e.healthy] + [e for e in order if not e.healthy]
+
+    def _call(self, function, order, retry_timeouts=True):
+        for endpoint in order:
+            with self._lock:
+                endpoint.outstanding += 1
+            try:
+                return function(endpoint)
+            except CapBACConnectionException as err:
+                if isinstance(err, CapBACTimeoutException) and not retry_timeouts:
+                    raise
+                error = err
+                self._eject(endpoint, err)
+            finally:
+                with self._lock:
+                    endpoint.outstanding -= 1
+        raise error
+
+    def _eject(self, endpoint, err):
+        with self._lock:
+            if not endpoint.healthy:
+                return
+            endpoint.healthy = False
+            LOGGER.warning('Ejected %s: %s', endpoint.transport.url, err)
+            if self._checker is None:
+                self._checker = threading.Thread(
+                    target=self._check, name='capbac-health', daemon=True)
+                self._checker.start()
+
+    def _check(self):
+        while True:
+            time.sleep(HEALTH_INTERVAL)
+            with self._lock:
+                ejected = [e for e in self._endpoints if not e.healthy]
+                if not ejected:
+                    self._checker = None
+                    return
+
+            for endpoint in ejected:
+                try:
+                    endpoint.transport.get_head()
+                except CapBACClientException:
+                    continue
+                with self._lock:
+                    endpoint.healthy = True
+                LOGGER.info('Readmitted %s', endpoint.transport.url)
+
+class _Endpoint:
+    def __init__(self, transport):
+        self.transport = transport
+        self.outstanding = 0
+        self.healthy = True
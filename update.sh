@@ -1,6 +1,8 @@
 #!/bin/sh
 cp capbac_version.py capbac-client/cli;
 cp capbac_version.py capbac-processor/processor;
+cp capbac_rules.py capbac-client/cli;
+cp capbac_rules.py capbac-processor/processor;
 cp -r capbac-client test/Subject;
 cp -r capbac-client test/Issuer;
 cp -r capbac-client test/Device;